@@ -1,14 +1,67 @@
+"""helpers for FUELFIRE8 coupled fire and vegetation simulation.
 
-from edit_config import ConfigFile
-from footprint import GetFootprint, Wedge
-from controller import (FuelFire, 
-                        RecordedFuelFire, 
-                        RepeatedFuelFire,
-                        PropegateModel, 
-                        CopyModel, 
-                        QuickUpdateProbs,
-                        NewFilterVar,
-                        AddNeighbors,
-                        FixAge,
-                        ChangeMosaic,
-                        )
+names are imported from their submodule on first use, so importing the
+package does not load the model controller (or its dependencies) for
+analysis and footprint only work.
+"""
+
+from __future__ import absolute_import
+
+import importlib
+import sys
+import types
+
+# exported name: submodule
+EXPORTS = {
+    'ConfigFile':       'edit_config',
+    'ConfigSweep':      'edit_config',
+    'GetFootprint':     'footprint',
+    'FootprintHalo':    'footprint',
+    'Wedge':            'footprint',
+    'HazardTables':     'analysis',
+    'RegimeStats':      'analysis',
+    'ProbabilityIntervals': 'analysis',
+    'ExportArrays':     'storage',
+    'MergeRepeats':     'storage',
+    'IngestMosaics':    'storage',
+    'ExportMetrics':    'metrics',
+    'ResultCache':      'cache',
+    'Leases':           'leases',
+    'RunBenchmarks':    'benchmark',
+    'CheckBaseline':    'benchmark',
+    'FuelFire':         'controller',
+    'RecordedFuelFire': 'controller',
+    'RepeatedFuelFire': 'controller',
+    'PropegateModel':   'controller',
+    'CopyModel':        'controller',
+    'QuickUpdateProbs': 'controller',
+    'NewFilterVar':     'controller',
+    'AddNeighbors':     'controller',
+    'FixAge':           'controller',
+    'ChangeMosaic':     'controller',
+    }
+
+
+class LazyModule(types.ModuleType):
+    """package module that imports the submodule of an exported name
+    when the name is first accessed"""
+    def __getattr__(self, name):
+        if name not in EXPORTS:
+            raise AttributeError(name)
+        module = importlib.import_module(__name__ + '.' + EXPORTS[name])
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__.keys() + EXPORTS.keys()))
+
+
+lazy = LazyModule(__name__, __doc__)
+lazy.__dict__.update(dict([(k, v) for k, v in globals().items() if k.startswith('__')]))
+lazy.__all__ = sorted(EXPORTS.keys())
+lazy.EXPORTS = EXPORTS
+lazy.LazyModule = LazyModule
+# keep the original module alive so its globals are not cleared
+lazy._module = sys.modules[__name__]
+sys.modules[__name__] = lazy
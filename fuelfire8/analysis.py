@@ -0,0 +1,579 @@
+"""analysis: summaries derived from RecordedFuelFire and RepeatedFuelFire data
+
+example::
+
+    >>> HazardTables(path, agebins=num.arange(0, 256, 8), hood=True)
+    >>> RegimeStats(path, chunk=64)
+    >>> ProbabilityIntervals(path, method='bootstrap', draws=2000)
+
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as num
+from netCDF4 import Dataset
+import unittest2 as unittest
+
+from fuelfire8.footprint import GetFootprint, FootprintHalo
+from fuelfire8.links import BreakLink
+from fuelfire8.storage import (NETCDF_FORMAT, OFFSET, MAXSTORED, RecordMosaics,
+                               ReachCellBytes, ReachCounts, TrialSlabs)
+
+TABLES = ['tabtrials', 'tabburned', 'tabreached', 'tabburnifreach']
+
+INTERVALS = ['hazardlow', 'hazardhigh', 'burnifreachlow', 'burnifreachhigh']
+
+# replicate bits (8, 256) of each packed byte value (first replicate in the high bit)
+BYTEBITS = num.unpackbits(num.arange(256, dtype='uint8').reshape((256, 1)), axis=1).T
+
+def HazardTables(path, agebins=None, fuelbins=None, hood=False, maxreps=256,
+                 footprintcode='5ne', membytes=2**28):
+    """Count trials, burned, reached, and burned if reached cells by age
+    class, fuel class and (optionally) neighborhood median age class in
+    a single pass over the packed trials of repeat.nc. the counts do not
+    depend on when step probabilities were last calculated. steps without
+    replicates are skipped
+
+
+    agebins/fuelbins
+        ascending lower bounds of each class (default every 8 steps or
+        levels). values below the first bound join the first class.
+
+    hood
+        add a third index of hoodmed class using the age bins (see
+        AddNeighbors). the tables are stored with a hood prefix
+
+    maxreps
+        replicates per step counted as trials (as UpdateStepProbs)
+
+    footprintcode
+        footprint of reached cells (as RepeatedFuelFire)
+
+    membytes
+        memory budget of the unpacked trials of one slab of rows
+
+
+    repeat.nc variables (dimensions)
+    --------------------------------
+
+    agebins (agec), fuelbins (fuelc), hoodbins (hoodc)
+        class lower bounds
+
+    tabtrials (agec, fuelc), hoodtabtrials (agec, fuelc, hoodc)
+        number of cell replicate trials
+
+    tabburned, tabreached, tabburnifreach (agec, fuelc)
+        number of burned, reached, and burned if reached cell trials
+
+    hoodtabburned, hoodtabreached, hoodtabburnifreach (agec, fuelc, hoodc)
+        as above by neighborhood median age class
+
+    """
+    if agebins is None:
+        agebins = num.arange(0, 256, 8)
+    if fuelbins is None:
+        fuelbins = num.arange(0, 256, 8)
+
+    footprint = GetFootprint(footprintcode)
+    halo = FootprintHalo(footprint)
+    rep = Dataset(os.path.join(path, 'repeat.nc'), 'a')
+    rep.set_auto_mask(False)
+    if hood and 'hoodmed' not in rep.variables:
+        raise StandardError('hoodmed not found, run AddNeighbors first')
+
+    bins = [('agec', 'agebins', agebins), ('fuelc', 'fuelbins', fuelbins)]
+    if hood:
+        bins.append(('hoodc', 'hoodbins', agebins))
+    shape = tuple([len(b) for (dim, var, b) in bins])
+    size = int(num.prod(shape))
+
+    counts = dict([(tab, num.zeros(size)) for tab in TABLES])
+    for s in range(len(rep.dimensions['t'])):
+        reps = int(min(rep.variables['reps'][s], maxreps))
+        if reps <= 0:
+            continue
+
+        classes = [ClassIndex(rep.variables['age'][s, :, :], agebins),
+                   ClassIndex(rep.variables['fuel'][s, :, :], fuelbins)]
+        if hood:
+            classes.append(ClassIndex(rep.variables['hoodmed'][s, :, :], agebins))
+        index = num.ravel_multi_index(classes, shape)
+
+        counts['tabtrials'] += reps * num.bincount(index.ravel(), minlength=size)
+        for (x0, x1, inner, trials) in TrialSlabs(rep, s, reps, halo, ReachCellBytes(reps), membytes):
+            slabindex = index[x0:x1].ravel()
+            for (tab, slabcounts) in zip(TABLES[1:], ReachCounts(trials, footprint)):
+                weights = slabcounts[inner].ravel().astype('f8')
+                counts[tab] += num.bincount(slabindex, weights=weights, minlength=size)
+
+    for (dim, var, b) in bins:
+        if dim not in rep.dimensions:
+            rep.createDimension(dim, len(b))
+        elif len(rep.dimensions[dim]) != len(b):
+            raise StandardError('{0} has {1} classes, not {2}'.format(dim, len(rep.dimensions[dim]), len(b)))
+        if var not in rep.variables:
+            rep.createVariable(var, 'i2', (dim,))
+        rep.variables[var][:] = b
+
+    dims = tuple([dim for (dim, var, b) in bins])
+    prefix = 'hood' if hood else ''
+    for tab in TABLES:
+        if prefix + tab not in rep.variables:
+            table = rep.createVariable(prefix + tab, 'f8', dims)
+            table.description = 'counts by ' + ', '.join(dims)
+        rep.variables[prefix + tab][:] = counts[tab].reshape(shape)
+
+    rep.sync()
+    rep.close()
+    return True
+
+def RegimeStats(path, agebins=None, chunk=32):
+    """Fire regime statistics of the recorded age time series, read
+    <chunk> steps at a time so memory does not depend on the number of
+    steps. a cell burns at step t when its age does not advance from step
+    t-1 (unless already at the age cap). both steps must be complete.
+    patches are 4-connected regions of equal age (cells last burned by
+    the same fire), so mean patch size by age class is agehist /
+    patchhist.
+
+
+    record.nc variables (dimensions)
+    --------------------------------
+
+    burncount (x, y)
+        number of burns
+
+    meanfri (x, y)
+        mean fire return interval in steps (-1 with fewer than 2 burns)
+
+    burnfrac (t)
+        fraction of the landscape burned at each step
+
+    agebins (agec)
+        age class lower bounds (default every 8 steps)
+
+    agehist (t, agec)
+        number of cells in each age class at each step
+
+    patchhist (t, agec)
+        number of patches in each age class at each step
+
+    maxpatch (t)
+        cells in the largest patch at each step
+
+    """
+    if agebins is None:
+        agebins = num.arange(0, 256, 8)
+
+    BreakLink(os.path.join(path, 'record.nc'))
+    rec = Dataset(os.path.join(path, 'record.nc'), 'a')
+    rec.set_auto_mask(False)
+    mosaics = RecordMosaics(rec)
+    complete = rec.variables['complete'][:] == 1
+    steps = len(rec.dimensions['t'])
+    shape = (len(rec.dimensions['x']), len(rec.dimensions['y']))
+
+    burncount = num.zeros(shape, dtype='i')
+    lastburn = -num.ones(shape, dtype='i')
+    intsum = num.zeros(shape, dtype='i')
+    intcount = num.zeros(shape, dtype='i')
+    burnfrac = num.zeros(steps)
+    agehist = num.zeros((steps, len(agebins)), dtype='i')
+    patchhist = num.zeros((steps, len(agebins)), dtype='i')
+    maxpatch = num.zeros(steps, dtype='i')
+
+    prev = None
+    for t0 in range(0, steps, chunk):
+        t1 = min(t0 + chunk, steps)
+        stored = mosaics.GetSteps(t0, t1, 'age')
+        for (k, t) in enumerate(range(t0, t1)):
+            if not complete[t]:
+                prev = None
+                continue
+
+            agehist[t] = num.bincount(ClassIndex(stored[k], agebins).ravel(), minlength=len(agebins))
+            (npatches, labels) = AgePatches(stored[k])
+            patchage = num.zeros(npatches, dtype=stored.dtype)
+            patchage[labels] = stored[k].ravel()
+            patchhist[t] = num.bincount(ClassIndex(patchage, agebins), minlength=len(agebins))
+            maxpatch[t] = num.max(num.bincount(labels))
+
+            age = stored[k].astype('i') + OFFSET
+            if prev is not None:
+                burn = (age <= prev) & (stored[k] < MAXSTORED)
+                again = burn & (lastburn >= 0)
+                intsum[again] += t - lastburn[again]
+                intcount[again] += 1
+                lastburn[burn] = t
+                burncount += burn
+                burnfrac[t] = num.mean(burn)
+            prev = age
+
+    meanfri = -num.ones(shape)
+    meanfri[intcount > 0] = intsum[intcount > 0] / num.asarray(intcount[intcount > 0], dtype='f8')
+
+    if 'agec' not in rec.dimensions:
+        rec.createDimension('agec', len(agebins))
+    elif len(rec.dimensions['agec']) != len(agebins):
+        raise StandardError('agec has {0} classes, not {1}'.format(len(rec.dimensions['agec']), len(agebins)))
+
+    for (var, dtype, dims, desc, data) in [
+            ('burncount', 'i2', ('x','y'), 'number of burns', burncount),
+            ('meanfri', 'f4', ('x','y'), 'mean fire return interval in steps', meanfri),
+            ('burnfrac', 'f4', ('t',), 'fraction burned', burnfrac),
+            ('agebins', 'i2', ('agec',), 'age class lower bounds', agebins),
+            ('agehist', 'i4', ('t','agec'), 'cells per age class', agehist),
+            ('patchhist', 'i4', ('t','agec'), 'equal age patches per age class', patchhist),
+            ('maxpatch', 'i4', ('t',), 'cells in the largest equal age patch', maxpatch)]:
+        if var not in rec.variables:
+            rec.createVariable(var, dtype, dims).description = desc
+        rec.variables[var][:] = data
+
+    rec.sync()
+    rec.close()
+    return True
+
+def ProbabilityIntervals(path, level=0.95, method='exact', draws=1000, footprintcode='5ne',
+                         maxreps=256, membytes=2**28, seed=0):
+    """Confidence intervals of the burn (hazard / reps) and burn if
+    reached (burnifreach / reached) probability of each cell and step,
+    calculated from the packed trials in slabs of rows within <membytes>
+
+
+    method
+        'exact' Clopper-Pearson binomial intervals, or 'bootstrap'
+        percentile intervals of <draws> resamples of the replicates. a
+        draw resamples the same replicates for every cell of a step and
+        is counted without unpacking, by looking up the resample
+        weighted popcount of each packed byte (see PackedCounts)
+
+    footprintcode
+        footprint of reached cells (as RepeatedFuelFire)
+
+    maxreps
+        replicates per step counted as trials (as UpdateStepProbs)
+
+
+    repeat.nc variables (dimensions)
+    --------------------------------
+
+    hazardlow, hazardhigh (t, x, y)
+        burn probability bounds (-1 without trials)
+
+    burnifreachlow, burnifreachhigh (t, x, y)
+        burn if reached probability bounds (-1 if never reached)
+
+    """
+    if method not in ['exact', 'bootstrap']:
+        raise StandardError('unknown interval method {0}'.format(method))
+
+    import scipy.ndimage
+    rand = num.random.RandomState(seed)
+    footprint = GetFootprint(footprintcode)
+    halo = FootprintHalo(footprint)
+    alpha = 1 - level
+
+    rep = Dataset(os.path.join(path, 'repeat.nc'), 'a')
+    rep.set_auto_mask(False)
+    for var in INTERVALS:
+        if var not in rep.variables:
+            rep.createVariable(var, 'f4', ('t','x','y',)).description = 'probability interval bound'
+    rep.intervallevel = level
+    rep.intervalmethod = method
+
+    for s in range(len(rep.dimensions['t'])):
+        reps = int(min(rep.variables['reps'][s], maxreps))
+        blocks = int(num.ceil(reps / 8.0))
+        cellbytes = ReachCellBytes(reps) + 32
+        if method == 'bootstrap':
+            # trials, reached, and burned if reached bits of every replicate
+            cellbytes = 3 * ReachCellBytes(reps) + 24 * draws
+            weights = num.zeros((draws, blocks * 8), dtype='i4')
+            if reps > 0:
+                weights[:, :reps] = rand.multinomial(reps, [1.0 / reps] * reps, size=draws)
+
+        for (x0, x1, inner, trials) in TrialSlabs(rep, s, reps, halo, cellbytes, membytes):
+            if method == 'exact':
+                (nburned, nreached, nburnifreach) = [n[inner] for n in ReachCounts(trials, footprint)]
+                bounds = (BinomialInterval(nburned, reps, alpha) +
+                          BinomialInterval(nburnifreach, nreached, alpha))
+            else:
+                reached = scipy.ndimage.maximum_filter(trials, footprint=footprint[num.newaxis])[:, inner]
+                burned = trials[:, inner]
+                burnifreach = num.bitwise_and(burned, reached)
+                nburned = PackedCounts(num.packbits(burned, axis=0), weights)
+                nreached = PackedCounts(num.packbits(reached, axis=0), weights)
+                nburnifreach = PackedCounts(num.packbits(burnifreach, axis=0), weights)
+                bounds = (PercentileInterval(nburned, num.ones(nburned.shape, dtype='i2') * reps, alpha) +
+                          PercentileInterval(nburnifreach, nreached, alpha))
+
+            for (var, bound) in zip(INTERVALS, bounds):
+                rep.variables[var][s, x0:x1, :] = bound
+        rep.sync()
+
+    rep.close()
+    return True
+
+def BinomialInterval(k, n, alpha):
+    """Clopper-Pearson (low, high) bounds of <k> successes of <n> trials
+    (-1 where n is 0)"""
+    import scipy.stats
+    k = num.asarray(k, dtype='f8')
+    n = num.asarray(n, dtype='f8') * num.ones(k.shape)
+    with num.errstate(invalid='ignore'):
+        low = num.where(k > 0, scipy.stats.beta.ppf(alpha / 2, k, n - k + 1), 0.0)
+        high = num.where(k < n, scipy.stats.beta.ppf(1 - alpha / 2, k + 1, n - k), 1.0)
+    low[n == 0] = -1
+    high[n == 0] = -1
+    return (low, high)
+
+def PercentileInterval(k, n, alpha):
+    """(low, high) percentiles (linearly interpolated, as num.percentile)
+    of the bootstrap ratios <k>/<n> over the last (draw) axis, ignoring
+    draws with n of 0 (-1 where all are 0)"""
+    with num.errstate(invalid='ignore', divide='ignore'):
+        ratio = num.true_divide(k, n, dtype='f4')
+    valid = num.sum(n > 0, axis=-1)
+    index = []
+    for q in [alpha / 2, 1 - alpha / 2]:
+        pos = q * num.maximum(valid - 1, 0)
+        i0 = num.floor(pos).astype('i')
+        i1 = num.minimum(i0 + 1, num.maximum(valid - 1, 0))
+        index.append((pos, i0, i1))
+
+    # only the order statistics at the bounds are needed when every draw
+    # is valid. otherwise sort (nan last)
+    full = valid == ratio.shape[-1]
+    if num.any(full):
+        kth = sorted(set([int(i[full][0]) for (pos, i0, i1) in index for i in [i0, i1]]))
+        ratio[full] = num.partition(ratio[full], kth, axis=-1)
+    ratio[~full] = num.sort(ratio[~full], axis=-1)
+
+    bounds = []
+    for (pos, i0, i1) in index:
+        a0 = num.take_along_axis(ratio, i0[..., None], axis=-1)[..., 0]
+        a1 = num.take_along_axis(ratio, i1[..., None], axis=-1)[..., 0]
+        bound = a0 + (pos - i0) * (a1 - a0)
+        bound[valid == 0] = -1
+        bounds.append(bound)
+    return tuple(bounds)
+
+def PackedCounts(packed, weights):
+    """weighted counts (..., draws) of replicate bits packed in (blocks,
+    ...) bytes given (draws, replicates) resample weights. each block is
+    counted by looking up the rows of a (256, draws) table of the
+    weighted popcount of every byte value"""
+    counts = num.zeros(packed.shape[1:] + (weights.shape[0],), dtype='i2')
+    for b in range(packed.shape[0]):
+        table = num.dot(BYTEBITS.T, weights[:, 8*b:8*b+8].T).astype('i2')
+        counts += num.take(table, packed[b], axis=0)
+    return counts
+
+def AgePatches(age):
+    """(number of patches, flat patch label of each cell) of the
+    4-connected regions of equal values of a 2d <age> array"""
+    import scipy.sparse
+    import scipy.sparse.csgraph
+    index = num.arange(age.size).reshape(age.shape)
+    right = age[:, 1:] == age[:, :-1]
+    down = age[1:, :] == age[:-1, :]
+    rows = num.concatenate([index[:, :-1][right], index[:-1, :][down]])
+    cols = num.concatenate([index[:, 1:][right], index[1:, :][down]])
+    graph = scipy.sparse.coo_matrix((num.ones(len(rows), dtype='i1'), (rows, cols)), shape=(age.size, age.size))
+    return scipy.sparse.csgraph.connected_components(graph, directed=False)
+
+def ClassIndex(stored, bins):
+    """class index of stored (offset) values given ascending class lower bounds"""
+    values = num.asarray(stored, dtype='i') + OFFSET
+    return num.clip(num.searchsorted(bins, values, side='right') - 1, 0, len(bins) - 1)
+
+
+class TestHazardTables(unittest.TestCase):
+    """HazardTables test fixture"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        rand = num.random.RandomState(5)
+        self.trials = (rand.rand(3, 16, 4, 3) < 0.2).astype('uint8')
+        self.trials[0, 8:] = 0
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'), 'w', format=NETCDF_FORMAT)
+        rep.createDimension('t', None)
+        rep.createDimension('r', 2)
+        rep.createDimension('x', 4)
+        rep.createDimension('y', 3)
+        rep.createVariable('reps', 'i2', ('t',))[:] = [8, 16, 0]
+        rep.createVariable('trials', 'i1', ('t','r','x','y',))
+        rep.variables['trials'][:] = num.packbits(self.trials, axis=1).astype('i') - OFFSET
+        for var in ['age', 'fuel', 'hoodmed']:
+            rep.createVariable(var, 'i1', ('t','x','y',))
+        for var in ['hazard', 'reached', 'burnifreach']:
+            rep.createVariable(var, 'i2', ('t','x','y',))
+
+        # the third step is initialized without replicates, so its age
+        # and fuel are fill values. derived counts are never written
+        age = num.arange(24).reshape((2, 4, 3))
+        rep.variables['age'][:2] = age - OFFSET
+        rep.variables['fuel'][:2] = num.mod(age, 2) - OFFSET
+        rep.variables['hoodmed'][:2] = age - OFFSET
+        rep.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_totals(self):
+        """tables count the packed trials of every step with replicates"""
+        import scipy.ndimage
+        HazardTables(self.path, agebins=[0, 12], fuelbins=[0, 1], footprintcode='3sw', membytes=200)
+        footprint = GetFootprint('3sw').reshape((1, 1, 3, 3))
+        reached = scipy.ndimage.maximum_filter(self.trials[:2], footprint=footprint)
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        self.assertEqual(rep.variables['tabtrials'].shape, (2, 2))
+        self.assertEqual(num.sum(rep.variables['tabtrials'][:]), 12 * 8 + 12 * 16)
+        self.assertEqual(num.sum(rep.variables['tabburned'][:]), self.trials[:2].sum())
+        self.assertEqual(num.sum(rep.variables['tabreached'][:]), reached.sum())
+        self.assertEqual(num.sum(rep.variables['tabburnifreach'][:]), (reached & self.trials[:2]).sum())
+
+        # first step is age class 0, second step is age class 1
+        self.assertTrue(num.all(rep.variables['tabtrials'][0, :] == [6 * 8, 6 * 8]))
+        self.assertTrue(num.all(rep.variables['tabtrials'][1, :] == [6 * 16, 6 * 16]))
+        self.assertEqual(rep.variables['tabburned'][1, :].sum(), self.trials[1].sum())
+        rep.close()
+
+    def test_hood(self):
+        """hoodmed adds a third index to separate tables"""
+        HazardTables(self.path, agebins=[0, 12], fuelbins=[0, 1])
+        HazardTables(self.path, agebins=[0, 12], fuelbins=[0, 1], hood=True)
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        self.assertEqual(rep.variables['tabburned'].shape, (2, 2))
+        self.assertEqual(rep.variables['hoodtabburned'].shape, (2, 2, 2))
+        self.assertEqual(rep.variables['hoodtabburned'][0, :, 1].sum(), 0)
+        self.assertEqual(rep.variables['hoodtabburned'][:].sum(), rep.variables['tabburned'][:].sum())
+        rep.close()
+
+    def test_reuse(self):
+        """recalculating replaces the tables and rejects new class counts"""
+        HazardTables(self.path, agebins=[0, 12], fuelbins=[0, 1])
+        HazardTables(self.path, agebins=[0, 6], fuelbins=[0, 1])
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        self.assertEqual(num.sum(rep.variables['tabburned'][:]), self.trials[:2].sum())
+        rep.close()
+        self.assertRaises(StandardError, HazardTables, self.path, agebins=[0, 6, 12])
+
+
+class TestRegimeStats(unittest.TestCase):
+    """RegimeStats test fixture"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        rec = Dataset(os.path.join(self.path, 'record.nc'), 'w', format=NETCDF_FORMAT)
+        rec.createDimension('t', 10)
+        rec.createDimension('x', 2)
+        rec.createDimension('y', 2)
+        rec.createVariable('complete', 'i1', ('t',))[:] = 1
+
+        age = num.zeros((10, 2, 2), dtype='i')
+        age[:, 0, 0] = [5, 6, 0, 1, 2, 0, 1, 2, 3, 0]  # burns at 2, 5, 9
+        age[:, 0, 1] = num.arange(10)                  # never burns
+        age[:, 1, 0] = MAXSTORED + OFFSET              # capped, never burns
+        age[:, 1, 1] = [3, 4, 5, 0, 0, 1, 2, 3, 4, 5]  # burns at 3, 4
+        rec.createVariable('age', 'i1', ('t','x','y',))[:] = age - OFFSET
+        rec.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_stats(self):
+        """burns are detected across chunk boundaries"""
+        RegimeStats(self.path, agebins=[0, 4], chunk=3)
+        rec = Dataset(os.path.join(self.path, 'record.nc'))
+        self.assertEqual(rec.variables['burncount'][:].tolist(), [[3, 0], [0, 2]])
+        self.assertEqual(rec.variables['meanfri'][:].tolist(), [[3.5, -1], [-1, 1]])
+        self.assertEqual(rec.variables['burnfrac'][:].tolist(), 
+                         [0, 0, 0.25, 0.25, 0.25, 0.25, 0, 0, 0, 0.25])
+        self.assertEqual(rec.variables['agehist'][0].tolist(), [2, 2])
+        self.assertEqual(num.sum(rec.variables['agehist'][:], axis=1).tolist(), [4] * 10)
+        self.assertEqual(rec.variables['patchhist'][:].tolist(), rec.variables['agehist'][:].tolist())
+        self.assertEqual(rec.variables['maxpatch'][:].tolist(), [1] * 10)
+        rec.close()
+
+    def test_patches(self):
+        """patches are connected cells of equal age"""
+        age = num.array([[3, 3, 0, 0],
+                         [1, 3, 0, 3],
+                         [1, 1, 1, 3]])
+        (npatches, labels) = AgePatches(age)
+        self.assertEqual(npatches, 4)
+        self.assertEqual(sorted(num.bincount(labels).tolist()), [2, 3, 3, 4])
+        self.assertEqual(len(set(labels[[0, 1, 5]])), 1)
+        self.assertNotEqual(labels[0], labels[7])
+
+    def test_incomplete(self):
+        """steps next to incomplete steps are not compared"""
+        rec = Dataset(os.path.join(self.path, 'record.nc'), 'a')
+        rec.variables['complete'][4] = 0
+        rec.close()
+        RegimeStats(self.path, agebins=[0, 4])
+        rec = Dataset(os.path.join(self.path, 'record.nc'))
+        self.assertEqual(rec.variables['burncount'][:].tolist(), [[2, 0], [0, 1]])
+        rec.close()
+
+
+class TestProbabilityIntervals(unittest.TestCase):
+    """ProbabilityIntervals test fixture"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        rand = num.random.RandomState(3)
+        self.trials = (rand.rand(2, 24, 9, 7) < [[[[0.05]]], [[[0.3]]]]).astype('uint8')
+        self.trials[0, 20:] = 0
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'), 'w', format=NETCDF_FORMAT)
+        rep.createDimension('t', None)
+        rep.createDimension('r', 3)
+        rep.createDimension('x', 9)
+        rep.createDimension('y', 7)
+        rep.createVariable('reps', 'i2', ('t',))[:] = [20, 24]
+        rep.createVariable('trials', 'i1', ('t','r','x','y',))
+        rep.variables['trials'][:] = num.packbits(self.trials, axis=1).astype('i') - OFFSET
+        rep.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_exact(self):
+        """slabs match whole grid binomial intervals around the estimate"""
+        ProbabilityIntervals(self.path, footprintcode='3sw')
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        whole = [rep.variables[var][:] for var in INTERVALS]
+        rep.close()
+        ProbabilityIntervals(self.path, footprintcode='3sw', membytes=2000)
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        for (var, data) in zip(INTERVALS, whole):
+            self.assertTrue(num.allclose(rep.variables[var][:], data), var)
+
+        p = self.trials[1].mean(axis=0)
+        self.assertTrue(num.all(rep.variables['hazardlow'][1] <= p))
+        self.assertTrue(num.all(rep.variables['hazardhigh'][1] >= p))
+        (low, high) = BinomialInterval(num.array([0, 5, 20]), 20, 0.05)
+        self.assertEqual((low[0], high[2]), (0, 1))
+        self.assertAlmostEqual(high[0], 1 - 0.025 ** (1 / 20.0))
+        rep.close()
+
+    def test_bootstrap(self):
+        """packed counts match unpacked weighted sums"""
+        weights = num.random.RandomState(0).multinomial(20, [1 / 20.0] * 20, size=50)
+        weights = num.hstack([weights, num.zeros((50, 4), dtype=weights.dtype)])
+        counts = PackedCounts(num.packbits(self.trials[0], axis=0), weights)
+        expect = num.tensordot(self.trials[0], weights, axes=(0, 1))
+        self.assertTrue(num.all(counts == expect))
+
+        ProbabilityIntervals(self.path, method='bootstrap', draws=400, footprintcode='3sw')
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        p = self.trials[1].mean(axis=0)
+        self.assertTrue(num.all(rep.variables['hazardlow'][1] <= p + 1e-6))
+        self.assertTrue(num.all(rep.variables['hazardhigh'][1] >= p - 1e-6))
+        self.assertTrue(num.mean(rep.variables['hazardhigh'][1] > rep.variables['hazardlow'][1]) > 0.9)
+        self.assertEqual(rep.intervalmethod, 'bootstrap')
+        rep.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,307 @@
+"""benchmark: timing and peak memory of post-processing kernels on
+synthetic RecordedFuelFire and RepeatedFuelFire data
+
+each kernel runs in a forked process on a fresh copy of the fixture so
+peak memory is measured per kernel and kernels that modify repeat.nc do
+not affect each other. results are compared with the baseline stored
+for the same fixture size in a json file.
+
+peak memory is read with the unix resource module, or with psutil where
+that is not available (Windows). without either it is not measured
+(peakkb None) and only times are compared. Windows starts kernel
+processes by importing the calling script, so scripts calling
+RunBenchmarks need an if __name__ == '__main__' guard there.
+
+example::
+
+    >>> results = RunBenchmarks(xlen=512, ylen=512, reps=64, burnfrac=0.05)
+    >>> CheckBaseline(results, 'benchmarks.json', tolerance=1.5)
+
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as num
+from netCDF4 import Dataset
+import unittest2 as unittest
+
+from fuelfire8.controller import RepeatedFuelFire, NewFilterVar, AddNeighbors
+from fuelfire8.footprint import GetFootprint, Wedge
+from fuelfire8.storage import CreateRecord, CreateRepeat, OFFSET
+
+try:
+    import resource
+except ImportError:
+    resource = None    # Windows
+
+def SyntheticModel(ffdir, steps=4, xlen=256, ylen=256, reps=64, burnfrac=0.05, seed=0):
+    """write record.nc and repeat.nc with <steps> complete steps of
+    random ages and <reps> replicates burning <burnfrac> of the cells.
+    repeat rows hold the age and fuel of their recorded step and zero
+    counts (as RepeatedFuelFire.InitStep)"""
+    rand = num.random.RandomState(seed)
+    if not os.path.exists(ffdir):
+        os.makedirs(ffdir)
+
+    rec = CreateRecord(os.path.join(ffdir, 'record.nc'), steps, xlen, ylen, fill=False)
+    age = rand.randint(0, 255, (xlen, ylen))
+    mosaics = []
+    for t in range(steps):
+        mosaics.append((age - OFFSET, num.minimum(age // 64, 3) - OFFSET))
+        rec.variables['age'][t, :, :] = mosaics[t][0]
+        rec.variables['fuel'][t, :, :] = mosaics[t][1]
+        age = num.minimum(age + 1, 254)
+        age[rand.rand(xlen, ylen) < burnfrac] = 0
+    rec.variables['complete'][:] = 1
+    rec.variables['shufsteps'][:] = rand.permutation(steps)
+    shufsteps = rec.variables['shufsteps'][:]
+    rec.close()
+
+    rep = CreateRepeat(os.path.join(ffdir, 'repeat.nc'), reps, xlen, ylen, 0)
+    blocks = len(rep.dimensions['r'])
+    for (s, step) in enumerate(shufsteps):
+        bits = (rand.rand(blocks * 8, xlen, ylen) < burnfrac).astype('uint8')
+        bits[reps:] = 0
+        rep.variables['step'][s] = step
+        rep.variables['reps'][s] = reps
+        rep.variables['age'][s, :, :] = mosaics[step][0]
+        rep.variables['fuel'][s, :, :] = mosaics[step][1]
+        for var in ['hazard', 'reached', 'burnifreach']:
+            rep.variables[var][s, :, :] = 0
+        rep.variables['trials'][s, :, :, :] = num.packbits(bits, axis=0).astype('i') - OFFSET
+    rep.close()
+
+def StepProbsKernel(ffdir, params):
+    """RepeatedFuelFire.UpdateStepProbs over every step"""
+    ff = RepeatedFuelFire(ffdir, footprintcode=params['footprintcode'])
+    ff.UpdateStepProbs(maxreps=params['reps'])
+    ff.rep.close()
+
+def NewFilterVarKernel(ffdir, params):
+    """median filter of every repeat.nc age step"""
+    rep = Dataset(os.path.join(ffdir, 'repeat.nc'), 'a')
+    NewFilterVar(rep, 'age', 'benchmed', GetFootprint(params['footprintcode']))
+    rep.close()
+
+def AddNeighborsKernel(ffdir, params):
+    """neighborhood median age of every recorded step"""
+    AddNeighbors(ffdir, params['footprintcode'])
+
+def SaveRepeatStepKernel(ffdir, params):
+    """repack the first 8 replicates of every step"""
+    ff = RepeatedFuelFire(ffdir)
+    shape = ff.rep.variables['trials'].shape[2:]
+    burn = (num.random.RandomState(1).rand(*shape) < params['burnfrac']).astype('uint8')
+    for s in range(len(ff.rep.dimensions['t'])):
+        ff.rep.variables['reps'][s] = 0
+    for r in range(8):
+        for s in range(len(ff.rep.dimensions['t'])):
+            ff.SaveRepeatStep(s, burn)
+    ff.rep.close()
+
+def WedgeKernel(ffdir, params):
+    """wedge footprints of every octant at radius 1 to 16"""
+    for radius in range(1, 17):
+        for start in range(0, 360, 45):
+            Wedge(radius, start, start + 45, maxdist=radius)
+
+# kernel name: function(ffdir, params)
+KERNELS = {
+    'stepprobs':        StepProbsKernel,
+    'newfiltervar':     NewFilterVarKernel,
+    'addneighbors':     AddNeighborsKernel,
+    'saverepeatstep':   SaveRepeatStepKernel,
+    'wedge':            WedgeKernel,
+    }
+
+def PeakKB():
+    """peak resident memory of this process in KB (None if it cannot be
+    measured)"""
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    mem = psutil.Process().memory_info()
+    return getattr(mem, 'peak_wset', mem.rss) // 1024
+
+def RunKernel(name, fixture, params, queue):
+    """time one kernel on a copy of <fixture> and put (seconds, peak
+    resident memory growth in KB) on <queue>. runs in a child process"""
+    ffdir = os.path.join(os.path.dirname(fixture), 'run')
+    shutil.copytree(fixture, ffdir)
+    try:
+        startkb = PeakKB()
+        start = time.time()
+        KERNELS[name](ffdir, params)
+        seconds = time.time() - start
+        peakkb = None
+        if startkb is not None:
+            peakkb = PeakKB() - startkb
+        queue.put((seconds, peakkb))
+    except Exception, e:
+        queue.put(e)
+    finally:
+        shutil.rmtree(ffdir)
+
+def FixtureLabel(params):
+    """baseline key of the fixture parameters"""
+    return '{xlen}x{ylen} steps{steps} reps{reps} burn{burnfrac} {footprintcode}'.format(**params)
+
+def RunBenchmarks(kernels=None, steps=4, xlen=256, ylen=256, reps=64, burnfrac=0.05,
+                  footprintcode='5ne', repeat=3):
+    """time each kernel on a synthetic fixture
+
+    kernels
+        names of KERNELS to run (default all)
+
+    steps, xlen, ylen, reps, burnfrac
+        fixture size and fraction of cells burned by each replicate (see
+        SyntheticModel)
+
+    repeat
+        runs of each kernel. the fastest time and largest memory are kept
+
+    returns {'fixture': label, 'params': params, 'kernels': {name:
+    {'seconds': s, 'peakkb': kb}}}. peakkb is None where memory cannot
+    be measured
+    """
+    if kernels is None:
+        kernels = sorted(KERNELS.keys())
+    params = {'steps': steps, 'xlen': xlen, 'ylen': ylen, 'reps': reps,
+              'burnfrac': burnfrac, 'footprintcode': footprintcode}
+
+    path = tempfile.mkdtemp()
+    results = {}
+    try:
+        fixture = os.path.join(path, 'fixture')
+        SyntheticModel(fixture, steps, xlen, ylen, reps, burnfrac)
+        for name in kernels:
+            runs = []
+            for r in range(repeat):
+                queue = multiprocessing.Queue()
+                proc = multiprocessing.Process(target=RunKernel, args=(name, fixture, params, queue))
+                proc.start()
+                result = queue.get()
+                proc.join()
+                if isinstance(result, Exception):
+                    raise StandardError('benchmark {0} failed: {1}'.format(name, result))
+                runs.append(result)
+            results[name] = {'seconds': min([s for (s, kb) in runs]),
+                             'peakkb': max([kb for (s, kb) in runs])}
+    finally:
+        shutil.rmtree(path)
+
+    return {'fixture': FixtureLabel(params), 'params': params, 'kernels': results}
+
+def CheckBaseline(results, filename, tolerance=1.5, memtolerance=1.5, update=False):
+    """compare RunBenchmarks <results> with the baseline of the same
+    fixture stored in the json <filename>. raises StandardError if any
+    kernel takes more than <tolerance> times the baseline seconds or
+    more than <memtolerance> times the baseline memory (plus 1 MB) where
+    both were measured.
+    kernels without a baseline are added to the file, and all are
+    replaced with <update>. returns a list of report lines"""
+    baselines = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            baselines = json.load(f)
+    baseline = baselines.setdefault(results['fixture'], {})
+
+    lines = []
+    regressions = []
+    for (name, result) in sorted(results['kernels'].items()):
+        memory = '{0:>9} KB'.format(result['peakkb'] if result['peakkb'] is not None else '-')
+        if name not in baseline or update:
+            baseline[name] = result
+            lines.append('{0:16} {1:9.3f} s {2} (new baseline)'.format(name, result['seconds'], memory))
+            continue
+
+        ratio = result['seconds'] / max(baseline[name]['seconds'], 1e-6)
+        ratios = '{0:.2f}x time'.format(ratio)
+        if ratio > tolerance:
+            regressions.append('{0} time {1:.2f}x baseline'.format(name, ratio))
+        if result['peakkb'] is not None and baseline[name]['peakkb'] is not None:
+            memratio = (result['peakkb'] + 1024.0) / (baseline[name]['peakkb'] + 1024.0)
+            ratios += ', {0:.2f}x memory'.format(memratio)
+            if memratio > memtolerance:
+                regressions.append('{0} memory {1:.2f}x baseline'.format(name, memratio))
+        lines.append('{0:16} {1:9.3f} s {2} ({3})'.format(name, result['seconds'], memory, ratios))
+
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(filename + '.tmp', filename)
+
+    if len(regressions) > 0:
+        raise StandardError('benchmark regressions for {0}: {1}'.format(results['fixture'], ', '.join(regressions)))
+    return lines
+
+
+class TestBenchmark(unittest.TestCase):
+    """benchmark test fixture"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_fixture(self):
+        """synthetic trials burn about burnfrac of the replicates"""
+        SyntheticModel(self.path, steps=2, xlen=40, ylen=30, reps=20, burnfrac=0.25)
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        trials = num.array(rep.variables['trials'][:], dtype='i') + OFFSET
+        bits = num.unpackbits(trials.astype('uint8'), axis=1)
+        self.assertEqual(list(rep.variables['reps'][:]), [20, 20])
+        self.assertEqual(bits[:, 20:].sum(), 0)
+        self.assertAlmostEqual(bits[:, :20].mean(), 0.25, delta=0.02)
+
+        rec = Dataset(os.path.join(self.path, 'record.nc'))
+        rec.set_auto_mask(False)
+        rep.set_auto_mask(False)
+        for (s, step) in enumerate(rep.variables['step'][:]):
+            for var in ['age', 'fuel']:
+                self.assertTrue(num.all(rep.variables[var][s] == rec.variables[var][step]))
+            self.assertTrue(num.all(rep.variables['hazard'][s] == 0))
+        self.assertGreater(len(num.unique(rep.variables['age'][:])), 100)
+        rec.close()
+        rep.close()
+
+    def test_baseline(self):
+        """every kernel runs and slower kernels fail the baseline check"""
+        results = RunBenchmarks(steps=2, xlen=24, ylen=20, reps=16, repeat=1)
+        self.assertEqual(sorted(results['kernels'].keys()), sorted(KERNELS.keys()))
+
+        filename = os.path.join(self.path, 'benchmarks.json')
+        CheckBaseline(results, filename)
+        CheckBaseline(results, filename)
+
+        with open(filename) as f:
+            baselines = json.load(f)
+        baselines[results['fixture']]['wedge']['seconds'] = results['kernels']['wedge']['seconds'] / 10
+        with open(filename, 'w') as f:
+            json.dump(baselines, f)
+        with self.assertRaises(StandardError):
+            CheckBaseline(results, filename)
+
+    def test_unmeasured(self):
+        """memory is not compared where it cannot be measured"""
+        filename = os.path.join(self.path, 'benchmarks.json')
+        results = {'fixture': 'small', 'params': {},
+                   'kernels': {'wedge': {'seconds': 1.0, 'peakkb': 100}}}
+        CheckBaseline(results, filename)
+        results['kernels']['wedge']['peakkb'] = None
+        lines = CheckBaseline(results, filename)
+        self.assertTrue(lines[0].endswith('- KB (1.00x time)'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+"""cache: content addressed store of derived step arrays
+
+results are saved under a hash of everything they are derived from, so
+a step is only recalculated when its inputs change.
+
+example::
+
+    >>> cache = ResultCache(os.path.join(path, 'cache'))
+    >>> key = CacheKey('hoodmed', age, footprint)
+    >>> arrays = cache.Get(key)
+    >>> if arrays is None:
+    ...     cache.Put(key, hoodmed=scipy.ndimage.median_filter(age, footprint=footprint))
+
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as num
+import unittest2 as unittest
+
+def CacheKey(*parts):
+    """hex digest of arrays (dtype, shape, and data) and other values"""
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, num.ndarray):
+            part = num.ascontiguousarray(part)
+            h.update('{0}{1}'.format(part.dtype.str, part.shape))
+            h.update(part.data)
+        else:
+            h.update(repr(part))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """arrays stored as <key>.npz files in <cachedir>. the least
+    recently used files are removed when the cache exceeds <maxbytes>"""
+    def __init__(self, cachedir, maxbytes=2**30):
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+        if not os.path.exists(self.cachedir):
+            os.makedirs(self.cachedir)
+        self.size = sum([size for (mtime, size, f) in self.Entries()])
+
+    def Entries(self):
+        """(modification time, size, filename) of each cached file"""
+        entries = []
+        for f in os.listdir(self.cachedir):
+            if f.endswith('.npz'):
+                stat = os.stat(os.path.join(self.cachedir, f))
+                entries.append((stat.st_mtime, stat.st_size, f))
+        return entries
+
+    def Get(self, key):
+        """dict of arrays stored under <key> or None"""
+        filename = os.path.join(self.cachedir, key + '.npz')
+        try:
+            with open(filename, 'rb') as f:
+                npz = num.load(f)
+                arrays = dict([(name, npz[name]) for name in npz.files])
+        except IOError:
+            return None
+
+        os.utime(filename, None)    # mark recently used
+        return arrays
+
+    def Put(self, key, **arrays):
+        """store named arrays under <key> and evict old entries"""
+        filename = os.path.join(self.cachedir, key + '.npz')
+        arrays = dict([(name, num.asarray(a)) for (name, a) in arrays.items()])
+        with open(filename + '.tmp', 'wb') as f:
+            num.savez(f, **arrays)
+
+        if os.path.exists(filename):
+            self.size -= os.path.getsize(filename)
+            os.remove(filename)
+        os.rename(filename + '.tmp', filename)
+        self.size += os.path.getsize(filename)
+
+        if self.size > self.maxbytes:
+            self.Evict()
+
+    def Evict(self):
+        """remove the least recently used files until within maxbytes"""
+        entries = sorted(self.Entries())
+        self.size = sum([size for (mtime, size, f) in entries])
+        while self.size > self.maxbytes and len(entries) > 0:
+            (mtime, size, f) = entries.pop(0)
+            os.remove(os.path.join(self.cachedir, f))
+            self.size -= size
+
+
+class TestResultCache(unittest.TestCase):
+    """ResultCache test fixture"""
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_key(self):
+        """keys depend on values, dtype, and shape"""
+        a = num.arange(6)
+        self.assertEqual(CacheKey('x', a, 3), CacheKey('x', num.arange(6), 3))
+        self.assertNotEqual(CacheKey('x', a, 3), CacheKey('x', a, 4))
+        self.assertNotEqual(CacheKey(a), CacheKey(a.reshape((2, 3))))
+        self.assertNotEqual(CacheKey(a), CacheKey(a.astype('i1')))
+
+    def test_get_put(self):
+        """stored arrays are returned by key"""
+        cache = ResultCache(self.cachedir)
+        self.assertEqual(cache.Get('k'), None)
+        cache.Put('k', hazard=num.ones((3, 2)), reached=num.zeros(2))
+        arrays = ResultCache(self.cachedir).Get('k')
+        self.assertEqual(sorted(arrays.keys()), ['hazard', 'reached'])
+        self.assertTrue(num.all(arrays['hazard'] == 1))
+
+    def test_evict(self):
+        """least recently used entries are evicted"""
+        cache = ResultCache(self.cachedir, maxbytes=10**9)
+        for (t, key) in enumerate(['a', 'b', 'c']):
+            cache.Put(key, data=num.zeros(1000))
+            filename = os.path.join(self.cachedir, key + '.npz')
+            os.utime(filename, (1000 + t, 1000 + t))
+        cache.maxbytes = cache.size - 1
+        cache.Put('a', data=num.zeros(1000))
+        self.assertEqual(cache.Get('b'), None)
+        self.assertNotEqual(cache.Get('c'), None)
+        self.assertNotEqual(cache.Get('a'), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
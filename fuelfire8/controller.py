@@ -1,33 +1,57 @@
 """classes for controlling, recording runs, and recording replicate runs on the FUELFIRE8 model"""
 
+import atexit
+import hashlib
 import logging
 import os
 import shutil
 import subprocess
+import tempfile
 import time
-import win32com.client
 
 import numpy as num
 from netCDF4 import Dataset
+import unittest2 as unittest
 
-try:
-    import scipy.ndimage
-except ImportError, e:
-    print e
-    
-from fuelfire8 import ConfigFile, GetFootprint, Wedge
+from fuelfire8.cache import CacheKey, ResultCache
+from fuelfire8.edit_config import ConfigFile
+from fuelfire8.footprint import GetFootprint, FootprintHalo, Wedge
+from fuelfire8.leases import Leases
+from fuelfire8.links import BreakLink, LinkFile
+from fuelfire8.metrics import METRICS
+from fuelfire8.storage import (CreateRecord, CreateRepeat, MergeRepeats, RecordMosaics,
+                               ReachCellBytes, ReachCounts, TrialSlabs)
 
 NETCDF_FORMAT = 'NETCDF3_CLASSIC'
 
-logging.basicConfig(format='%(asctime)s:%(levelname)s:%(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
-logging.getLogger().setLevel(logging.INFO)
-logging.getLogger().addHandler(logging.FileHandler('log.txt'))
-SHELL = win32com.client.Dispatch("WScript.Shell")
+# set by SetupLogging and Shell when the first controller needs them
+LOGFILE = None
+SHELL = None
+
+def SetupLogging(logfile='log.txt'):
+    """log to the console and <logfile> in the current directory (once)"""
+    global LOGFILE
+    if LOGFILE is not None:
+        return
+    
+    logging.basicConfig(format='%(asctime)s:%(levelname)s:%(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    logging.getLogger().setLevel(logging.INFO)
+    logging.getLogger().addHandler(logging.FileHandler(logfile))
+    LOGFILE = logfile
+
+def Shell():
+    """WScript.Shell used to send keys to the model window (created on first use)"""
+    global SHELL
+    if SHELL is None:
+        import win32com.client
+        SHELL = win32com.client.Dispatch("WScript.Shell")
+    return SHELL
 
 def PropegateModel(dst, src=None, copyrecord=False, copyrepeats=False,
-                   modif=None, caption=None, 
+                   link=False, modif=None, caption=None, 
                    spinup=0, recordlength=None, runrecord=0, 
-                   repeatlength=None, runrepeats=(0,0), stepoffset=0 
+                   repeatlength=None, runrepeats=(0,0), stepoffset=0,
+                   stagedir=None, keyint=None
                    ):
     """[Main interface] Copy an existing model with options to handle
     data files, modify configuration, run spinup, "record" or "repeat"
@@ -44,6 +68,11 @@ def PropegateModel(dst, src=None, copyrecord=False, copyrepeats=False,
         
     copyrepeats
         copy the RepeatedFuelFire data file when copying the model.
+    
+    link
+        hardlink the executable and RecordedFuelFire data file instead of
+        copying them (see CopyModel). a linked record is copied before
+        recordlength or runrecord write to it
         
     modif         
         Configuration modifications list (see fuelfire8.EditConfig)
@@ -74,27 +103,41 @@ def PropegateModel(dst, src=None, copyrecord=False, copyrepeats=False,
         Temporarily add <stepoffset> to the list of shuffled steps.
         choose 1 to run the second of pairs of steps.
     
+    stagedir
+        run the model in a staging directory created under <stagedir>
+        (e.g. RAM backed /dev/shm, see FuelFire.Stage)
+    
+    keyint
+        delta encode a new RecordedFuelFire data file with a full
+        keyframe every <keyint> steps (see RecordedFuelFire)
+    
     """
     if src is not None:
-        CopyModel(src, dst, record=copyrecord, repeat=copyrepeats)
-    
-    if modif is not None and caption is not None:
+        CopyModel(src, dst, record=copyrecord, repeat=copyrepeats, link=link,
+                  modif=modif, caption=caption)
+    elif modif is not None and caption is not None:
         FuelFire(dst).EditConfig(modif,caption)
 
     if spinup > 0:
-        FuelFire(dst).StraightSteps(spinup)
+        ff = FuelFire(dst, stagedir=stagedir)
+        ff.StraightSteps(spinup)
+        ff.Unstage()
 
     if recordlength is not None:
-        RecordedFuelFire(dst, recordlength)
+        RecordedFuelFire(dst, recordlength, keyint=keyint)
 
     if runrecord > 0:
-        RecordedFuelFire(dst).RunSteps(runrecord)
+        rec = RecordedFuelFire(dst, stagedir=stagedir)
+        rec.RunSteps(runrecord)
+        rec.ff.Unstage()
     
     if repeatlength is not None:
         RepeatedFuelFire(dst, maxreps=repeatlength,stepoffset=stepoffset)
 
     if runrepeats[0] > 0 and runrepeats[1] > 0:
-        RepeatedFuelFire(dst).RunReps(runrepeats[0],runrepeats[1])
+        rep = RepeatedFuelFire(dst, stagedir=stagedir)
+        rep.RunReps(runrepeats[0],runrepeats[1])
+        rep.rec.ff.Unstage()
     
 
 class FuelFire:
@@ -109,13 +152,19 @@ class FuelFire:
     WAITTIMEOUT = 180   # timeout for model.wait()
     KILLTIMEOUT = 20    # timeout for model.kill()
     
-    def __init__(self, ffdir):
+    # model files copied to a staging directory
+    STAGEFILES  = ['FUELFIRE.EXE', 'FUELFIRE.CFG', 'AGEPIX.DAT', 'CANOPIX.DAT']
+    
+    def __init__(self, ffdir, stagedir=None):
+        SetupLogging()
         self.ffdir    = ffdir
-        self.burnfile = os.path.join(self.ffdir, 'BURNT0OUT.TXT')
+        self.name     = os.path.basename(os.path.normpath(self.ffdir))
         self.config   = os.path.join(self.ffdir, 'FUELFIRE.CFG')
-        self.exefile  = os.path.join(self.ffdir, 'FUELFIRE.EXE')
-        self.agefile  = os.path.join(self.ffdir, 'AGEPIX.DAT')
-        self.fuelfile = os.path.join(self.ffdir, 'CANOPIX.DAT')
+        self.rundir   = self.ffdir
+        self.SetRunFiles()
+        
+        if stagedir is not None:
+            self.Stage(stagedir)
 
         # instance variables initialized later
         #   status      False if something went wrong during this step 
@@ -127,8 +176,44 @@ class FuelFire:
         """Use the EditConfig module modify the config file"""
         cf = ConfigFile(self.config)
         cf.PresetModify(modlist,caption)
+        if self.rundir != self.ffdir:
+            shutil.copy(self.config, os.path.join(self.rundir, 'FUELFIRE.CFG'))
         logging.info('modified '+str(modlist))
     
+    def SetRunFiles(self):
+        """set the paths of files the model reads and writes in rundir"""
+        self.burnfile = os.path.join(self.rundir, 'BURNT0OUT.TXT')
+        self.exefile  = os.path.join(self.rundir, 'FUELFIRE.EXE')
+        self.agefile  = os.path.join(self.rundir, 'AGEPIX.DAT')
+        self.fuelfile = os.path.join(self.rundir, 'CANOPIX.DAT')
+    
+    def Stage(self, stagedir):
+        """run the model in a new directory under <stagedir> (e.g. RAM
+        backed /dev/shm) holding copies of the model files. the staging
+        directory is removed by Unstage or at exit"""
+        self.rundir = tempfile.mkdtemp(prefix='fuelfire_%s_' % self.name, dir=stagedir)
+        for f in self.STAGEFILES:
+            shutil.copy(os.path.join(self.ffdir, f), os.path.join(self.rundir, f))
+        self.SetRunFiles()
+        atexit.register(self.Unstage)
+        logging.info('staged %s in %s' % (self.name, self.rundir))
+    
+    def Unstage(self):
+        """copy the current mosaic back to the model directory and remove
+        the staging directory"""
+        if self.rundir == self.ffdir:
+            return
+        
+        for f in ['AGEPIX.DAT', 'CANOPIX.DAT']:
+            shutil.copy(os.path.join(self.rundir, f), os.path.join(self.ffdir, f))
+        if os.path.realpath(os.getcwd()).startswith(os.path.realpath(self.rundir)):
+            os.chdir(self.ffdir)
+        shutil.rmtree(self.rundir)
+        
+        logging.info('unstaged %s from %s' % (self.name, self.rundir))
+        self.rundir = self.ffdir
+        self.SetRunFiles()
+    
     def TimedRun(self, holdmin):
         """Run the FUELFIRE normally (for spin-up). remove the sequence of files."""
         logging.info('Timed Run (%d min)' % holdmin)
@@ -161,6 +246,7 @@ class FuelFire:
                 return 
             else:
                 logging.info('retry single steps')
+                METRICS.Count('fuelfire_retries_total', self.name)
                      
     def SingleStep(self,fatal=False):
         """Run a single model step"""
@@ -171,7 +257,7 @@ class FuelFire:
         
     def StartModel(self):
         """Start the fuelfire model"""
-        os.chdir(self.ffdir)
+        os.chdir(self.rundir)
         if os.path.exists(self.burnfile):
             os.remove(self.burnfile)
 
@@ -180,7 +266,7 @@ class FuelFire:
         self.starttime = time.time()
         self.FF_EXE = subprocess.Popen(self.exefile, shell=False)      
         time.sleep(self.LAUNCHWAIT)
-        SHELL.SendKeys('{ESC}')
+        Shell().SendKeys('{ESC}')
 
     def ModelWait(self, fatalerror=True):
         """Wait for the running model to write the BURNOUT file"""
@@ -197,6 +283,7 @@ class FuelFire:
                     time.sleep(self.MODSLEEP)
 
         logging.warning('Wait Timeout')    
+        METRICS.Count('fuelfire_wait_timeouts_total', self.name)
         self.status = False
         return False
 
@@ -204,8 +291,8 @@ class FuelFire:
         """Kill any running FUELFIRE threads using the process name"""
         starttime = time.time()
         
-        SHELL.SendKeys('{ESC}') # break full screen
-        SHELL.SendKeys('^S')    # pause the model (helps kill faster)
+        Shell().SendKeys('{ESC}') # break full screen
+        Shell().SendKeys('^S')    # pause the model (helps kill faster)
         
         with open('execlog.txt', 'w') as f:
             while not self.FF_EXE.poll():
@@ -214,13 +301,15 @@ class FuelFire:
                     time.sleep(self.POLLSLEEP)
 
         os.remove('execlog.txt')
-        os.chdir(self.ffdir)
+        os.chdir(self.rundir)
         
         if time.time() - starttime < self.KILLTIMEOUT:
             self.steptime = str(int(time.time() - self.starttime))
+            METRICS.Observe('fuelfire_step_seconds', self.name, time.time() - self.starttime)
             return True
         else:
             logging.error('Kill Timeout')
+            METRICS.Count('fuelfire_kill_timeouts_total', self.name)
             self.status = False
             return None
 
@@ -238,7 +327,7 @@ class FuelFire:
         #[os.remove(f) for f in glob.glob("BURNT[0-9]+OUT.TXT")]
         n = 0
         while 1:
-            f = os.path.join(self.ffdir,'BURNT%dOUT.TXT' % n)
+            f = os.path.join(self.rundir,'BURNT%dOUT.TXT' % n)
             if not os.path.exists(f):
                 break
             
@@ -266,43 +355,41 @@ class RecordedFuelFire:
     
     shufsteps (t)
         randomly ordered step index (inhereted by replication experiments)
+    
+    a record created with <keyint> replaces age and fuel with keyframes
+    every keyint steps and the changed cells of the steps between (see
+    storage.RecordMosaics). read mosaics through self.mosaics
         
     """
-    def __init__(self, ffdir, maxsteps=None):
-        """Load existing record or create empty record"""
-        self.ff = FuelFire(ffdir)
+    def __init__(self, ffdir, maxsteps=None, mode='a', stagedir=None, keyint=None):
+        """Load existing record or create empty record. Use mode='r' to
+        open an existing record read-only (e.g. a record hardlinked by
+        CopyModel for replicate workers). a hardlinked record opened for
+        writing is first replaced by a copy (see links.BreakLink).
+        stagedir is passed to FuelFire"""
+        self.ff = FuelFire(ffdir, stagedir=stagedir)
         self.ncfile = os.path.join(ffdir, 'record.nc')
         
         if os.path.exists(self.ncfile):
-            self.nc = Dataset(self.ncfile,'a')
+            if mode != 'r':
+                BreakLink(self.ncfile)
+            self.nc = Dataset(self.ncfile,mode)
+            self.mosaics = RecordMosaics(self.nc)
             
         if (not os.path.exists(self.ncfile)) & (maxsteps != None):
-            self.CreateEmptyRecord(maxsteps)
+            self.CreateEmptyRecord(maxsteps, keyint)
             self.nc = Dataset(self.ncfile,'a')
+            self.mosaics = RecordMosaics(self.nc)
         
         if (not os.path.exists(self.ncfile)) & (maxsteps == None):
             raise StandardError('file not found {0}'.format(self.ncfile))    
     
-    def CreateEmptyRecord(self, steps):
+    def CreateEmptyRecord(self, steps, keyint=None):
         """create and empty record of age and fuel"""
         (xlen, ylen) = num.loadtxt(self.ff.agefile).shape
         
-        self.nc = Dataset(self.ncfile, 'w', format=NETCDF_FORMAT)
-        self.nc.createDimension('t', steps)
-        self.nc.createDimension('x', xlen)
-        self.nc.createDimension('y', ylen)
-        
-        age = self.nc.createVariable('age', 'i1', ('t','x','y',))
-        fuel = self.nc.createVariable('fuel', 'i1', ('t','x','y',))
-        complete = self.nc.createVariable('complete', 'i1', ('t',))
-        shufsteps = self.nc.createVariable('shufsteps', 'i2', ('t',))
-        
-        age[:,:,:] = -128
-        fuel[:,:,:] = -128
-        complete[:] = 0
-        steplist = num.arange(steps)
-        num.random.shuffle(steplist)
-        shufsteps[:] = steplist
+        self.nc = CreateRecord(self.ncfile, steps, xlen, ylen, keyint=keyint)
+        self.mosaics = RecordMosaics(self.nc)
         
         self.SaveMosaic(0)    
     
@@ -320,9 +407,12 @@ class RecordedFuelFire:
                 self.SaveMosaic(step)
                 if self.ff.status == True:
                     logging.info('completed step %d' % step)
+                    METRICS.Count('fuelfire_steps_total', self.ff.name)
+                    METRICS.Set('fuelfire_last_progress_seconds', self.ff.name, time.time())
                     steps = steps[1:]
             else:
                 logging.info('retry step %d' % step)
+                METRICS.Count('fuelfire_retries_total', self.ff.name)
         
         logging.info('Run Steps: completed %s' % os.path.basename(self.ff.ffdir))
             
@@ -331,22 +421,24 @@ class RecordedFuelFire:
         age = -127 + num.loadtxt(self.ff.agefile, dtype='i')
         fuel = -127 + num.loadtxt(self.ff.fuelfile, dtype='i')
         if step > 0:
-            agediff = age - (self.nc.variables['age'][step-1, :, :])
+            agediff = age - self.mosaics.Get(step-1)[0]
             if num.mean(agediff == 0) > 0.5:
                 logging.warning('ERROR: mosaic is same as previous step')
                 self.ff.status = False
                 return False
             
-        self.nc.variables['age'][step, :, :] = age 
-        self.nc.variables['fuel'][step, :, :] = fuel 
+        writestart = time.time()
+        self.mosaics.Put(step, age, fuel)
         self.nc.variables['complete'][step] = 1
         self.nc.sync()
+        METRICS.Observe('fuelfire_write_seconds', self.ff.name, time.time() - writestart)
         logging.debug('saved step %d' % step)
 
     def ReLoadMosaic(self, step):
         """write age and fuel data from <step> to the current fuelfire text data files"""
-        num.savetxt(self.ff.agefile, 127 + self.nc.variables['age'][step, :, :], fmt='%4i')
-        num.savetxt(self.ff.fuelfile, 127 + self.nc.variables['fuel'][step, :, :], fmt='%4i')
+        (age, fuel) = self.mosaics.Get(step)
+        num.savetxt(self.ff.agefile, 127 + age.astype('i'), fmt='%4i')
+        num.savetxt(self.ff.fuelfile, 127 + fuel.astype('i'), fmt='%4i')
         logging.debug('reloaded mosaic %d' % step) 
 
         
@@ -381,9 +473,23 @@ class RepeatedFuelFire:
         number of times burned and reached
     
     """
-    def __init__(self, ffdir, maxreps=None, stepoffset=None,footprintcode='5ne',calcint=32):
-        """load or create empty RepeatedFuelFire data"""
-        self.rec = RecordedFuelFire(ffdir)
+    def __init__(self, ffdir, maxreps=None, stepoffset=None,footprintcode='5ne',calcint=32,membytes=None,stagedir=None,cachedir=None,cachebytes=2**30):
+        """load or create empty RepeatedFuelFire data
+        
+        membytes
+            memory budget in bytes for calculating step probabilities
+            in slabs of rows (default None processes the whole grid at
+            once)
+        
+        stagedir
+            run the model in a staging directory under <stagedir> (see
+            FuelFire.Stage)
+        
+        cachedir, cachebytes
+            reuse step probabilities saved in a ResultCache when the
+            step trials, replicate counts, and footprint are unchanged 
+        """
+        self.rec = RecordedFuelFire(ffdir, mode='r', stagedir=stagedir)
         self.repfile = os.path.join(ffdir, 'repeat.nc')
         
         if not os.path.exists(self.repfile) and maxreps is not None:
@@ -393,40 +499,18 @@ class RepeatedFuelFire:
         
         self.footprintcode = footprintcode
         self.calcint = calcint
+        self.membytes = membytes
+        self.cache = None
+        if cachedir is not None:
+            self.cache = ResultCache(cachedir, cachebytes)
         
     def CreateEmptyRecord(self, reps, stepoffset):
         """create a new empty record. the number of repeats be specified
         but the number of mosaic steps analyzed can grow dynamically"""
-        self.rep = Dataset(self.repfile, 'w', format=NETCDF_FORMAT)
-        self.rep.stepoffset = stepoffset
-        self.rep.createDimension('t', None)
-        self.rep.createDimension('r', num.ceil(reps/8.0))
-        self.rep.createDimension('x', len(self.rec.nc.dimensions['x']))
-        self.rep.createDimension('y', len(self.rec.nc.dimensions['y']))
-        
-        steps = self.rep.createVariable('step', 'i2', ('t',))
-        steps.description = 'original step number'
-        
-        repvar = self.rep.createVariable('reps', 'i2', ('t',))
-        repvar.description = 'repeats per step'
-        
-        trials = self.rep.createVariable('trials', 'i1', ('t','r','x','y',))
-        trials.description = 'bitpacked repeat trials results'
-        
-        age = self.rep.createVariable('age', 'i1', ('t','x','y',))
-        age.description = 'time since fire in model steps'
-
-        fuel = self.rep.createVariable('fuel', 'i1', ('t','x','y',))
-        fuel.description = 'fuel'
-
-        haz = self.rep.createVariable('hazard', 'i2', ('t','x','y',))
-        haz.description = 'burned'
-        
-        reach = self.rep.createVariable('reached', 'i2', ('t','x','y',))
-        reach.description = 'reached'
-        
-        burnifreach = self.rep.createVariable('burnifreach', 'i2', ('t','x','y',))
-        burnifreach = 'burned and reached'
+        self.rep = CreateRepeat(self.repfile, reps, 
+                                len(self.rec.nc.dimensions['x']), 
+                                len(self.rec.nc.dimensions['y']), 
+                                stepoffset)
         
     def RunReps(self, reps=None, steplim=None):
         """run <reps> replicated trials on steps up to <steplim> or"""
@@ -436,15 +520,11 @@ class RepeatedFuelFire:
             steplim = len(self.rec.nc.dimensions['t'])
             
         for i, step in enumerate(self.rec.nc.variables['shufsteps'][:steplim]):
-            xstep = step + self.rep.stepoffset
-            if xstep > num.max(self.rec.nc.variables['shufsteps']):
-                xstep = 0
+            xstep = self.OffsetStep(step)
                 
             if self.rec.nc.variables['complete'][xstep] == 1:
                 if len(self.rep.variables['step'][:]) == i:
-                    self.rep.variables['step'][i] = xstep
-                    self.rep.variables['reps'][i] = 0
-                    self.rep.variables['trials'][i,:,:,:] = -127                
+                    self.InitStep(i, xstep)
                 
                 xstep = self.rep.variables['step'][i]
                     
@@ -454,13 +534,102 @@ class RepeatedFuelFire:
                     if (self.rec.ff.status == True) & (type(self.rec.ff.burndata) != type(None)):
                         self.SaveRepeatStep(i, self.rec.ff.burndata)
                         logging.info('saved step %d (%d) %d reps (%d) %s sec %s' % (i, xstep, reps, self.rep.variables['reps'][i], self.rec.ff.steptime, os.path.basename(self.rec.ff.ffdir)))
+                        METRICS.Count('fuelfire_replicates_total', self.rec.ff.name)
+                        METRICS.Set('fuelfire_last_progress_seconds', self.rec.ff.name, time.time())
                         if num.mod(self.rep.variables['reps'][i], self.calcint) == 0: 
                             self.StepProbabilities(i, step)
+                    else:
+                        METRICS.Count('fuelfire_retries_total', self.rec.ff.name)
                 
                 #logging.info('completed step %d (%d) %d reps (%d) %s' % (i, step, reps, self.rep.variables['reps'][i], os.path.basename(self.rec.ff.ffdir)))
     
+    def RunLeasedReps(self, leasedir, reps=None, steplim=None, owner=None, ttl=600, waitsleep=60):
+        """run <reps> replicated trials on steps up to <steplim> shared
+        with other hosts. each host runs in its own model directory
+        (e.g. a linked CopyModel of the experiment) and claims blocks of
+        8 replicates through leases in the shared <leasedir> (see
+        Leases). returns when every block is done.
+        
+        a finished block is saved at its own block index of this
+        directory's repeat.nc shard (see SaveRepeatBlock) and then
+        completed. a block completed first by another owner is cleared
+        again. a block saved by a host that dies before completing it is
+        rerun elsewhere, and MergeRepeats takes each block index from
+        one shard only, so a block is never counted twice. step
+        probabilities of the shard are left to MergeRepeats"""
+        if reps == None:
+            reps = 8 * len(self.rep.dimensions['r'])    
+        if steplim == None:
+            steplim = len(self.rec.nc.dimensions['t'])
+        
+        leases = Leases(leasedir, owner=owner, ttl=ttl)
+        if 'blockreps' not in self.rep.variables:
+            blockreps = self.rep.createVariable('blockreps', 'i2', ('t','r',))
+            blockreps.description = 'replicates saved at each block index'
+            self.rep.sync()
+        shufsteps = self.rec.nc.variables['shufsteps'][:steplim]
+        blocks = int(num.ceil(reps/8.0))
+        units = [(i, b) for (i, step) in enumerate(shufsteps) for b in range(blocks)
+                 if self.rec.nc.variables['complete'][self.OffsetStep(step)] == 1]
+        
+        while len(leases.Pending(units)) > 0:
+            unit = leases.ClaimNext(units)
+            if unit is None:
+                time.sleep(waitsleep)   # wait for running or abandoned leases
+                continue
+            
+            (i, b) = unit
+            for k in range(len(self.rep.variables['step'][:]), i + 1):
+                self.InitStep(k, self.OffsetStep(shufsteps[k]))
+            xstep = self.rep.variables['step'][i]
+            
+            burns = []
+            while len(burns) < min(8, reps - 8 * b) and leases.Renew(unit):
+                self.rec.ReLoadMosaic(xstep)
+                self.rec.ff.SingleStep()
+                if (self.rec.ff.status == True) & (type(self.rec.ff.burndata) != type(None)):
+                    burns.append(self.rec.ff.burndata)
+                    METRICS.Count('fuelfire_replicates_total', self.rec.ff.name)
+                    METRICS.Set('fuelfire_last_progress_seconds', self.rec.ff.name, time.time())
+                else:
+                    METRICS.Count('fuelfire_retries_total', self.rec.ff.name)
+            
+            if not leases.Renew(unit):
+                logging.warning('lost lease on step %d block %d' % unit)
+                continue
+            
+            self.SaveRepeatBlock(i, b, burns)
+            if not leases.Complete(unit):
+                self.SaveRepeatBlock(i, b, [])
+                logging.warning('step %d block %d completed by another owner' % unit)
+                continue
+            logging.info('saved step %d (%d) block %d (%d reps) %s' % (i, xstep, b, self.rep.variables['reps'][i], leases.owner))
+    
+    def OffsetStep(self, step):
+        """recorded step replicated for shuffled <step> after adding
+        stepoffset (wrapping to step 0)"""
+        xstep = step + self.rep.stepoffset
+        if xstep > num.max(self.rec.nc.variables['shufsteps']):
+            xstep = 0
+        return xstep
+    
+    def InitStep(self, i, xstep):
+        """start empty replicate row <i> of recorded step <xstep> with its
+        age and fuel and zero counts"""
+        (age, fuel) = self.rec.mosaics.Get(xstep)
+        self.rep.variables['step'][i] = xstep
+        self.rep.variables['reps'][i] = 0
+        self.rep.variables['trials'][i,:,:,:] = -127                
+        self.rep.variables['age'][i,:,:] = age
+        self.rep.variables['fuel'][i,:,:] = fuel
+        for var in ['hazard', 'reached', 'burnifreach']:
+            self.rep.variables[var][i,:,:] = 0
+        if 'blockreps' in self.rep.variables:
+            self.rep.variables['blockreps'][i,:] = 0
+    
     def SaveRepeatStep(self, step, burn):
         """save one replicate. binary data is packed into (m,n,8) blocks of integers"""
+        writestart = time.time()
         i = int(num.floor(self.rep.variables['reps'][step]/8.0))
         im = num.mod(self.rep.variables['reps'][step],8)
         
@@ -472,7 +641,23 @@ class RepeatedFuelFire:
         self.rep.variables['trials'][step,i,:,:] = -127 + num.packbits(unpack, axis=0)
         self.rep.variables['reps'][step] += 1
         self.rep.sync()
+        METRICS.Observe('fuelfire_write_seconds', self.rec.ff.name, time.time() - writestart)
             
+    def SaveRepeatBlock(self, step, block, burns):
+        """save up to 8 replicates at <block> of row <step>, replacing any
+        replicates saved there before (an empty list clears the block).
+        reps counts the replicates of every block (see RunLeasedReps)"""
+        writestart = time.time()
+        unpack = num.zeros((8,) + self.rep.variables['trials'].shape[2:], dtype='uint8')
+        if len(burns) > 0:
+            unpack[:len(burns)] = burns
+        
+        self.rep.variables['trials'][step,block,:,:] = -127 + num.packbits(unpack, axis=0)[0]
+        self.rep.variables['blockreps'][step,block] = len(burns)
+        self.rep.variables['reps'][step] = num.sum(num.maximum(self.rep.variables['blockreps'][step,:], 0))
+        self.rep.sync()
+        METRICS.Observe('fuelfire_write_seconds', self.rec.ff.name, time.time() - writestart)
+    
     def UpdateStepProbs(self, steplim=None,maxreps=256):
         """recalculate step probabilities for every step"""
         if steplim == None:
@@ -485,7 +670,11 @@ class RepeatedFuelFire:
         """calculate the probability of 
             being reached by fire at a specified radius.
             catching fire if reached  
-            
+        
+        the grid is processed in slabs of rows sized to the membytes
+        budget (see storage.TrialSlabs). each slab is read with a halo of
+        the footprint radius so the stitched result is identical to a
+        whole grid calculation.
         """
         print('probs')
         reps = self.rep.variables['reps'][s]
@@ -494,49 +683,101 @@ class RepeatedFuelFire:
 
         blockreps = int(num.ceil(reps/8.0))
             
-        self.rep.variables['age'][s,:,:] = self.rec.nc.variables['age'][step,:,:]
-        self.rep.variables['fuel'][s,:,:] = self.rec.nc.variables['fuel'][step,:,:]
+        (age, fuel) = self.rec.mosaics.Get(step)
+        self.rep.variables['age'][s,:,:] = age
+        self.rep.variables['fuel'][s,:,:] = fuel
         footprint = GetFootprint(self.footprintcode)
-            
-        # probability of being reached
-        trials = num.unpackbits(num.array(127 + self.rep.variables['trials'][s, :blockreps, :, :], dtype='uint8'), axis=0)
-        self.rep.variables['hazard'][s,:,:] = num.sum(trials, axis=0)
-        self.rep.variables['reached'][s,:,:] = 0
-        self.rep.variables['burnifreach'][s,:,:] = 0
-        for i in num.arange(reps):
-            zz = scipy.ndimage.maximum_filter(trials[i,:,:], footprint=footprint)
-            self.rep.variables['reached'][s,:,:] += zz
-            self.rep.variables['burnifreach'][s,:,:] += num.bitwise_and(trials[i,:,:], zz)
+        if self.cache is not None:
+            key = CacheKey('stepprobs', self.TrialsDigest(s, blockreps), 
+                           self.rep.variables['reps'][s], maxreps, footprint)
+            arrays = self.cache.Get(key)
+            if arrays is not None:
+                for var in ['hazard', 'reached', 'burnifreach']:
+                    self.rep.variables[var][s,:,:] = arrays[var]
+                self.rep.sync()
+                print 'step probs %d (%d reps, cached)' % (s, reps)
+                return
+        
+        halo = FootprintHalo(footprint)
+        for (x0, x1, inner, trials) in TrialSlabs(self.rep, s, reps, halo, ReachCellBytes(reps), self.membytes):
+            hazard, reached, burnifreach = ReachCounts(trials, footprint)
+            self.rep.variables['hazard'][s,x0:x1,:] = hazard[inner]
+            self.rep.variables['reached'][s,x0:x1,:] = reached[inner]
+            self.rep.variables['burnifreach'][s,x0:x1,:] = burnifreach[inner]
         
         self.rep.sync()
+        if self.cache is not None:
+            self.cache.Put(key, **dict([(var, self.rep.variables[var][s,:,:]) 
+                                        for var in ['hazard', 'reached', 'burnifreach']]))
         print 'step probs %d (%d reps)' % (s, reps)
-           
-def CopyModel(src, dst,repeat=False,record=False):
-    """copy all relevant model files from <src> to <dest> with options for copying recorded and repeated data files"""
+    
+    def TrialsDigest(self, s, blockreps):
+        """hash of the first <blockreps> packed trials blocks of row <s>
+        read in slabs within the membytes budget"""
+        h = hashlib.sha1()
+        xlen = len(self.rep.dimensions['x'])
+        ylen = len(self.rep.dimensions['y'])
+        slab = xlen
+        if self.membytes is not None:
+            slab = max(int(self.membytes / (max(blockreps, 1) * ylen)), 1)
+        
+        for x0 in range(0, xlen, slab):
+            h.update(num.ascontiguousarray(self.rep.variables['trials'][s, :blockreps, x0:x0+slab, :]).data)
+        return h.hexdigest()
+
+def CopyModel(src, dst,repeat=False,record=False,link=False,modif=None,caption=None):
+    """copy all relevant model files from <src> to <dest> with options for copying recorded and repeated data files
+    
+    link
+        hardlink files that are never modified by the copy (the
+        executable and the record, see links.LinkFile). writers of the
+        record (RecordedFuelFire, RegimeStats) replace a linked record
+        with a copy first. falls back to copying where links are not
+        supported.
+    
+    modif, caption
+        configuration modifications (see ConfigFile.PresetModify)
+        applied while writing the copied config file
+    """
     if os.path.exists(dst):
         shutil.rmtree(dst)
     if not os.path.exists(dst):
         os.makedirs(dst)
     
     files = ['FUELFIRE.EXE','FUELFIRE.CFG','CANOPIX.DAT','AGEPIX.DAT']
+    linked = ['FUELFIRE.EXE']
     
     if record and os.path.exists(os.path.join(src, 'record.nc')):
         files.append('record.nc')
+        linked.append('record.nc')
         
     if repeat and os.path.exists(os.path.join(src, 'repeat.nc')):
         files.append('repeat.nc')
     
-    [shutil.copy(os.path.join(src, f), os.path.join(dst, f)) for f in files]
+    if modif is not None and caption is not None:
+        files.remove('FUELFIRE.CFG')
+        cf = ConfigFile(os.path.join(src, 'FUELFIRE.CFG'))
+        cf.configfile = os.path.join(dst, 'FUELFIRE.CFG')
+        cf.PresetModify(modif, caption)
+        logging.info('modified '+str(modif))
+    
+    for f in files:
+        if link and f in linked:
+            LinkFile(os.path.join(src, f), os.path.join(dst, f))
+        else:
+            shutil.copy(os.path.join(src, f), os.path.join(dst, f))
     
     logging.info('Copied to %s' % dst)
-    
-def QuickUpdateProbs(path, footprintcode='7ne',maxreps=160):
-    """Recalculate derived step probabilities given an input footprint code string"""
-    RepeatedFuelFire(path, footprintcode=footprintcode).UpdateStepProbs(maxreps=maxreps)
+
+def QuickUpdateProbs(path, footprintcode='7ne',maxreps=160,cachedir=None):
+    """Recalculate derived step probabilities given an input footprint code string. 
+    steps found in the <cachedir> ResultCache are not recalculated"""
+    RepeatedFuelFire(path, footprintcode=footprintcode, cachedir=cachedir).UpdateStepProbs(maxreps=maxreps)
     return True
 
 def NewFilterVar(nc, srcvar, tarvar, footprint, dtype='i',dim=('t','x','y')):
     """create a new xyt variable by applying a median filter each step slice of an existing xyt variable"""
+    import scipy.ndimage
     print('New Filter Variable: {0} from {1}'.format(tarvar, srcvar))
     if srcvar not in nc.variables:
         raise StandardError('source var {0} not found'.format(srcvar))
@@ -550,18 +791,35 @@ def NewFilterVar(nc, srcvar, tarvar, footprint, dtype='i',dim=('t','x','y')):
         nc.variables[tarvar][step,:,:] = scipy.ndimage.median_filter(nc.variables[srcvar][step,:,:], footprint=footprint)
         print('{0}'.format(step))
     
-def AddNeighbors(path, footprintcode='3sw', stepoffset=None):
-    """create and/or recalculate a median age variable""" 
+def AddNeighbors(path, footprintcode='3sw', stepoffset=None, cachedir=None):
+    """create and/or recalculate a median age variable. steps found in
+    the <cachedir> ResultCache are not recalculated""" 
+    import scipy.ndimage
     print('calculate neighborhood age')
-    rec = RecordedFuelFire(path)
+    rec = RecordedFuelFire(path, mode='r')
     ff = RepeatedFuelFire(path)
     if 'hoodmed' not in ff.rep.variables:
         hoodmed = ff.rep.createVariable('hoodmed', 'i1', ('t','x','y',))
         hoodmed.description = 'median age in neighborhood'
         ff.rep.sync()
 
+    cache = None
+    if cachedir is not None:
+        cache = ResultCache(cachedir)
+    footprint = GetFootprint(footprintcode)
+    
     for s, step in enumerate(ff.rep.variables['step'][:]):    
-        ff.rep.variables['hoodmed'][s, :, :] = scipy.ndimage.median_filter(rec.nc.variables['age'][step, :, :], footprint=GetFootprint(footprintcode))
+        age = rec.mosaics.Get(step)[0]
+        arrays = None
+        if cache is not None:
+            key = CacheKey('hoodmed', num.asarray(age), footprint)
+            arrays = cache.Get(key)
+        
+        if arrays is None:
+            arrays = {'hoodmed': scipy.ndimage.median_filter(age, footprint=footprint)}
+            if cache is not None:
+                cache.Put(key, **arrays)
+        ff.rep.variables['hoodmed'][s, :, :] = arrays['hoodmed']
         
         print step
         
@@ -570,14 +828,15 @@ def AddNeighbors(path, footprintcode='3sw', stepoffset=None):
 def FixAge(path, stepoffset):
     """Recopy the age and fuel data from replicate model to fix a previous copying error""" 
     print('fix age')
-    rec = RecordedFuelFire(path)
+    rec = RecordedFuelFire(path, mode='r')
     ff = RepeatedFuelFire(path)
     ff.rep.variables['step'][:] = rec.nc.variables['shufsteps'][0:len(ff.rep.variables['step'][:])] + stepoffset
     ff.rep.sync()
     
     for s, step in enumerate(ff.rep.variables['step'][:]):
-        ff.rep.variables['age'][s, :, :] = rec.nc.variables['age'][step, :, :]
-        ff.rep.variables['fuel'][s, :, :] = rec.nc.variables['fuel'][step, :, :]
+        (age, fuel) = rec.mosaics.Get(step)
+        ff.rep.variables['age'][s, :, :] = age
+        ff.rep.variables['fuel'][s, :, :] = fuel
         print step
     
     
@@ -588,4 +847,137 @@ def ChangeMosaic(ffdir, agesrc, fuelsrc):
     fuel = num.array(num.loadtxt(os.path.join(ffdir,fuelsrc), delimiter=','), dtype='i')
     num.savetxt(ff.agefile, num.transpose(age), fmt='%4i')
     num.savetxt(ff.fuelfile, num.transpose(fuel), fmt='%4i')
-    
\ No newline at end of file
+    
+
+
+class TestStaging(unittest.TestCase):
+    """FuelFire staging test fixture"""
+    def setUp(self):
+        self.ffdir = tempfile.mkdtemp()
+        self.stagedir = tempfile.mkdtemp()
+        for f in FuelFire.STAGEFILES:
+            with open(os.path.join(self.ffdir, f), 'w') as fh:
+                fh.write(f)
+    
+    def tearDown(self):
+        shutil.rmtree(self.ffdir)
+        shutil.rmtree(self.stagedir)
+    
+    def test_stage(self):
+        """model files are staged and the mosaic is copied back"""
+        ff = FuelFire(self.ffdir, stagedir=self.stagedir)
+        self.assertEqual(os.path.dirname(ff.rundir), self.stagedir)
+        self.assertEqual(os.path.dirname(ff.agefile), ff.rundir)
+        self.assertEqual(sorted(os.listdir(ff.rundir)), sorted(FuelFire.STAGEFILES))
+        
+        with open(ff.agefile, 'w') as fh:
+            fh.write('new age')
+        ff.Unstage()
+        ff.Unstage()
+        
+        self.assertEqual(os.listdir(self.stagedir), [])
+        self.assertEqual(ff.agefile, os.path.join(self.ffdir, 'AGEPIX.DAT'))
+        with open(ff.agefile) as fh:
+            self.assertEqual(fh.read(), 'new age')
+
+
+
+class TestCopyModel(unittest.TestCase):
+    """CopyModel test fixture"""
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.dst = os.path.join(tempfile.mkdtemp(), 'copy')
+        for f in ['FUELFIRE.EXE', 'FUELFIRE.CFG', 'CANOPIX.DAT', 'AGEPIX.DAT']:
+            with open(os.path.join(self.src, f), 'w') as fh:
+                fh.write(f)
+        nc = CreateRecord(os.path.join(self.src, 'record.nc'), 3, 2, 2)
+        nc.variables['complete'][:] = [1, 1, 0]
+        nc.close()
+    
+    def tearDown(self):
+        shutil.rmtree(self.src)
+        shutil.rmtree(os.path.dirname(self.dst))
+    
+    def test_linked_record(self):
+        """writing a linked record does not change the source record"""
+        CopyModel(self.src, self.dst, record=True, link=True)
+        rec = RecordedFuelFire(self.dst, mode='r')
+        rec.nc.close()
+        rec = RecordedFuelFire(self.dst)
+        rec.nc.variables['complete'][2] = 1
+        rec.nc.close()
+        
+        nc = Dataset(os.path.join(self.src, 'record.nc'))
+        self.assertEqual(list(nc.variables['complete'][:]), [1, 1, 0])
+        nc.close()
+        self.assertNotEqual(os.stat(os.path.join(self.src, 'record.nc')).st_ino,
+                            os.stat(os.path.join(self.dst, 'record.nc')).st_ino)
+
+
+
+class TestLeasedReps(unittest.TestCase):
+    """RunLeasedReps test fixture with a stub model step"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.leasedir = os.path.join(self.path, 'leases')
+        self.hosts = {}
+        for host in ['a', 'b']:
+            ffdir = os.path.join(self.path, host)
+            os.makedirs(ffdir)
+            for f in ['AGEPIX.DAT', 'CANOPIX.DAT']:
+                num.savetxt(os.path.join(ffdir, f), num.ones((3, 4)), fmt='%4i')
+            nc = CreateRecord(os.path.join(ffdir, 'record.nc'), 2, 3, 4)
+            nc.variables['age'][:] = 5 - 127
+            nc.variables['complete'][:] = 1
+            nc.variables['shufsteps'][:] = [1, 0]
+            nc.close()
+            RepeatedFuelFire(ffdir, maxreps=16, stepoffset=0).rep.close()
+            self.hosts[host] = RepeatedFuelFire(ffdir)
+            self.hosts[host].rec.ff.SingleStep = self.Stub(self.hosts[host].rec.ff)
+    
+    def tearDown(self):
+        for ff in self.hosts.values():
+            ff.rep.close()
+        shutil.rmtree(self.path)
+    
+    def Stub(self, ff, before=None):
+        """model step that burns random cells, calling <before> first"""
+        def SingleStep():
+            if before is not None:
+                before()
+            ff.status = True
+            ff.burndata = (num.random.rand(3, 4) < 0.5).astype('uint8')
+        return SingleStep
+    
+    def test_completed_elsewhere(self):
+        """a block completed by another owner is not kept"""
+        other = Leases(self.leasedir, owner='other')
+        a = self.hosts['a']
+        a.rec.ff.SingleStep = self.Stub(a.rec.ff, lambda: other.Owner((0, 1)) == 'a' and other.Complete((0, 1)))
+        a.RunLeasedReps(self.leasedir, reps=16, steplim=1, owner='a', waitsleep=0)
+        self.assertEqual(list(a.rep.variables['blockreps'][0]), [8, 0])
+        self.assertEqual(a.rep.variables['reps'][0], 8)
+    
+    def test_shards(self):
+        """empty rows and blocks saved twice are merged once"""
+        (a, b) = (self.hosts['a'], self.hosts['b'])
+        a.RunLeasedReps(self.leasedir, reps=16, steplim=1, owner='a', waitsleep=0)
+        b.RunLeasedReps(self.leasedir, reps=16, steplim=2, owner='b', waitsleep=0)
+        self.assertEqual(list(b.rep.variables['reps'][:]), [0, 16])
+        self.assertEqual(b.rep.variables['age'][0].tolist(), [[5 - 127] * 4] * 3)
+        
+        # b saved block 0 of row 0 before dying, and a reran it
+        b.SaveRepeatBlock(0, 0, [num.ones((3, 4), dtype='uint8')] * 8)
+        a.rep.sync()
+        b.rep.sync()
+        MergeRepeats([a.rec.ff.ffdir, b.rec.ff.ffdir], self.path)
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        self.assertEqual(list(rep.variables['reps'][:]), [16, 16])
+        trials = num.array(127 + rep.variables['trials'][0].astype('i'), dtype='uint8')
+        expect = num.array(127 + a.rep.variables['trials'][0].astype('i'), dtype='uint8')
+        self.assertTrue(num.all(trials == expect))
+        rep.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
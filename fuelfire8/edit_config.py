@@ -5,8 +5,24 @@ example::
 	>>> cf = ConfigFile(cfg_path)
 	>>> cf.PresetModify([('risk', 'ONLY_H')], 'a new caption')
 	
+	>>> sweep = ConfigSweep(cfg_path)
+	>>> points = sweep.Factorial([(('&GETFUEL','MATURE_FUEL_FACTOR'), [0.2, 0.4]),
+	...                           (('&GETSTATES','HI_FREQ'), [0, 65, 100])])
+	>>> sweep.WriteSweep(expdir, points, src=model_path)
+	
 """
 
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as num
+import unittest2 as unittest
+
+from fuelfire8.links import LinkFile
+
 
 class ConfigFile:
 	"""FUELFIRE configuration file with methods to read, edit, and write
@@ -123,6 +139,169 @@ class ConfigFile:
 			elif isopen == False:
 				if line.count(self.pheads[p]) == 1:
 					isopen = True
+
+
+class ConfigSweep:
+	"""render many variants of a template configuration file
+	
+	
+	the template is read and indexed once into a compiled index of
+	(group, parameter): (line number, line prefix). a variant only
+	formats the lines of its parameters. a sweep point is a list of
+	((group, parameter), value) pairs
+	"""
+	#model files written to each sweep directory. files the model never modifies are linked 
+	FILES = ['FUELFIRE.EXE', 'CANOPIX.DAT', 'AGEPIX.DAT']
+	LINKED = ['FUELFIRE.EXE']
+	
+	def __init__(self, configfile):
+		"""Read and index the template config file"""
+		self.template = ConfigFile(configfile)
+		self.index = {}
+		for (group, params) in self.template.pmap.items():
+			for (par, l) in params.items():
+				line = self.template.lines[l]
+				self.index[(group, par)] = (l, line[:line.find('=')+1])
+	
+	def Line(self, group, par):
+		"""line number and prefix of the given group and parameter"""
+		key = (group.upper(), par.upper())
+		if key not in self.index:
+			raise StandardError('parameter {0} {1} not found in {2}'.format(group, par, self.template.configfile))
+		return self.index[key]
+	
+	def Factorial(self, grid):
+		"""every combination of a list of ((group, parameter), values)"""
+		keys = [key for (key, values) in grid]
+		[self.Line(*key) for key in keys]
+		return [zip(keys, values) for values in itertools.product(*[values for (key, values) in grid])]
+	
+	def LatinHypercube(self, ranges, n, seed=0):
+		"""<n> points of a Latin hypercube over a list of ((group,
+		parameter), range). a (low, high) tuple range is sampled
+		uniformly within each of n strata and a list range picks the
+		level of each stratum"""
+		rand = num.random.RandomState(seed)
+		columns = []
+		for (key, span) in ranges:
+			self.Line(*key)
+			q = (rand.permutation(n) + rand.uniform(size=n)) / n
+			if isinstance(span, tuple):
+				columns.append([span[0] + u * (span[1] - span[0]) for u in q])
+			else:
+				columns.append([span[int(u * len(span))] for u in q])
+		keys = [key for (key, span) in ranges]
+		return [zip(keys, values) for values in zip(*columns)]
+	
+	def Render(self, point):
+		"""lines of the config file with the values of a sweep point"""
+		lines = list(self.template.lines)
+		for ((group, par), val) in point:
+			(l, prefix) = self.Line(group, par)
+			lines[l] = "{} {} \n".format(prefix, val)
+		return lines
+	
+	def WriteSweep(self, expdir, points, src=None, prefix='sweep', caption=True):
+		"""write the config of each sweep point to <expdir>/<prefix>NNNN
+		and a sweep.json manifest of directory parameter values
 		
+		
+		src
+			model directory whose FILES are linked or copied into each
+			sweep directory (None writes only the config files)
+		
+		caption
+			set the CAPTION parameter to the quoted directory name unless
+			it is swept
+		
+		"""
+		if not os.path.exists(expdir):
+			os.makedirs(expdir)
+		
+		manifest = {'template': os.path.abspath(self.template.configfile), 'runs': {}}
+		for (i, point) in enumerate(points):
+			name = '{0}{1:04d}'.format(prefix, i)
+			rundir = os.path.join(expdir, name)
+			if not os.path.exists(rundir):
+				os.makedirs(rundir)
+			
+			point = list(point)
+			if caption and ('&GETBASIC', 'CAPTION') not in [key for (key, val) in point]:
+				point.append((('&GETBASIC', 'CAPTION'), "'{0}'".format(name)))
+			with open(os.path.join(rundir, 'FUELFIRE.CFG'), 'w') as f:
+				[f.write(line) for line in self.Render(point)]
+			
+			if src is not None:
+				for filename in self.FILES:
+					dst = os.path.join(rundir, filename)
+					if os.path.exists(dst):
+						os.remove(dst)
+					if filename in self.LINKED:
+						LinkFile(os.path.join(src, filename), dst)
+					else:
+						shutil.copy(os.path.join(src, filename), dst)
+			manifest['runs'][name] = dict([('{0} {1}'.format(group, par), val) for ((group, par), val) in point])
+		
+		with open(os.path.join(expdir, 'sweep.json'), 'w') as f:
+			json.dump(manifest, f, indent=2, sort_keys=True)
+		return manifest
+	
+
+class TestConfigSweep(unittest.TestCase):
+	"""ConfigSweep test fixture"""
+	def setUp(self):
+		self.path = tempfile.mkdtemp()
+		self.configfile = os.path.join(self.path, 'FUELFIRE.CFG')
+		lines = ['&GETBASIC', "CAPTION = 'base'", '/']
+		lines += [head + '\n/' for head in ConfigFile.pheads[1:4]]
+		lines += ['&GETFUEL', 'IMMATURE_FUEL_FACTOR = 1', 'MATURE_FUEL_FACTOR = 0.4', '/']
+		lines += ['&GETSTRIKE', '/', '&GETSTATES', 'LO_FREQ = 540', 'HI_FREQ = 65', '/']
+		with open(self.configfile, 'w') as f:
+			f.write('\n'.join(lines) + '\n')
+	
+	def tearDown(self):
+		shutil.rmtree(self.path)
+	
+	def test_factorial(self):
+		"""each directory config holds its point values"""
+		sweep = ConfigSweep(self.configfile)
+		points = sweep.Factorial([(('&GETFUEL','MATURE_FUEL_FACTOR'), [0.2, 0.4]),
+								  (('&GETSTATES','HI_FREQ'), [0, 65, 100])])
+		self.assertEqual(len(points), 6)
+		manifest = sweep.WriteSweep(os.path.join(self.path, 'exp'), points)
+		self.assertEqual(manifest['runs']['sweep0005']['&GETSTATES HI_FREQ'], 100)
+		
+		cf = ConfigFile(os.path.join(self.path, 'exp', 'sweep0004', 'FUELFIRE.CFG'))
+		self.assertEqual(cf.lines[cf.pmap['&GETSTATES']['HI_FREQ']], 'HI_FREQ = 65 \n')
+		self.assertEqual(cf.lines[cf.pmap['&GETFUEL']['MATURE_FUEL_FACTOR']], 'MATURE_FUEL_FACTOR = 0.4 \n')
+		self.assertEqual(cf.lines[cf.pmap['&GETBASIC']['CAPTION']], "CAPTION = 'sweep0004' \n")
+		self.assertRaises(StandardError, sweep.Factorial, [(('&GETFUEL','NOPE'), [1])])
+	
+	def test_files(self):
+		"""model files are linked or copied into every directory"""
+		for filename in ConfigSweep.FILES:
+			with open(os.path.join(self.path, filename), 'w') as f:
+				f.write(filename)
+		sweep = ConfigSweep(self.configfile)
+		points = sweep.Factorial([(('&GETSTATES','HI_FREQ'), [0, 65])])
+		sweep.WriteSweep(os.path.join(self.path, 'exp'), points, src=self.path)
+		sweep.WriteSweep(os.path.join(self.path, 'exp'), points, src=self.path)
+		for filename in ConfigSweep.FILES:
+			with open(os.path.join(self.path, 'exp', 'sweep0001', filename)) as f:
+				self.assertEqual(f.read(), filename)
+		if hasattr(os, 'link'):
+			self.assertEqual(os.stat(os.path.join(self.path, 'FUELFIRE.EXE')).st_nlink, 3)
+			self.assertEqual(os.stat(os.path.join(self.path, 'AGEPIX.DAT')).st_nlink, 1)
+	
+	def test_latin_hypercube(self):
+		"""each parameter range is sampled once per stratum"""
+		sweep = ConfigSweep(self.configfile)
+		points = sweep.LatinHypercube([(('&GETFUEL','MATURE_FUEL_FACTOR'), (0.0, 1.0)),
+									   (('&GETSTATES','LO_FREQ'), [0, 100, 200, 300])], 4)
+		factors = sorted([point[0][1] for point in points])
+		self.assertEqual([int(f * 4) for f in factors], [0, 1, 2, 3])
+		self.assertEqual(sorted([point[1][1] for point in points]), [0, 100, 200, 300])
 
 
+if __name__ == "__main__":
+	unittest.main()
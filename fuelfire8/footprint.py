@@ -285,6 +285,10 @@ footprintdict = dict([(k,num.transpose(v)) for k,v in rawfootprintdict.items()])
 def GetFootprint(code):
     """return a footprint given the key"""
     return footprintdict[code]
+
+def FootprintHalo(footprint):
+    """number of cells a footprint reaches beyond its center cell"""
+    return max(num.shape(footprint)) // 2
    
 if __name__ == "__main__":
     unittest.TextTestRunner(verbosity=2).run(unittest.makeSuite(TestWedge))
@@ -0,0 +1,207 @@
+"""leases: claim units of work through files in a shared directory
+
+each unit (e.g. a block of 8 replicates of one step) is claimed by
+exclusively creating <unit>.lease and finished by creating <unit>.done.
+a lease whose file has not been renewed (touched) for <ttl> seconds is
+abandoned and may be broken and reclaimed by another owner. lease times
+are file modification times, so <ttl> should be much longer than the
+clock difference between hosts and the time between renewals.
+
+example::
+
+    >>> leases = Leases(leasedir, ttl=900)
+    >>> unit = leases.ClaimNext([(0, 0), (0, 1), (1, 0)])
+    >>> leases.Renew(unit)
+    >>> leases.Complete(unit)
+
+"""
+
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+import unittest2 as unittest
+
+
+class Leases:
+    """work unit leases held as files in a shared directory"""
+    def __init__(self, leasedir, owner=None, ttl=600):
+        """<owner> defaults to host name and process id"""
+        if owner is None:
+            owner = '%s-%d' % (socket.gethostname(), os.getpid())
+
+        self.leasedir = leasedir
+        self.owner = owner
+        self.ttl = ttl
+        if not os.path.exists(self.leasedir):
+            try:
+                os.makedirs(self.leasedir)
+            except OSError:
+                pass    # created by another host
+
+    def UnitFile(self, unit, ext):
+        """lease or done file of a unit tuple"""
+        name = '_'.join([str(u) for u in unit])
+        return os.path.join(self.leasedir, '%s.%s' % (name, ext))
+
+    def IsDone(self, unit):
+        """True if the unit has been completed by any owner"""
+        return os.path.exists(self.UnitFile(unit, 'done'))
+
+    def Owner(self, unit):
+        """owner of the current lease or None"""
+        try:
+            with open(self.UnitFile(unit, 'lease'), 'r') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def IsExpired(self, filename):
+        """True if a lease file has not been renewed for ttl seconds"""
+        try:
+            return time.time() - os.stat(filename).st_mtime > self.ttl
+        except OSError:
+            return False
+
+    def Claim(self, unit):
+        """try to lease a unit, breaking an expired lease. returns True
+        if this owner now holds the lease"""
+        if self.IsDone(unit):
+            return False
+
+        lease = self.UnitFile(unit, 'lease')
+        if self.IsExpired(lease):
+            self.Break(unit)
+
+        try:
+            fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            return False
+        os.write(fd, self.owner)
+        os.close(fd)
+
+        if self.IsDone(unit):   # completed between the checks
+            os.remove(lease)
+            return False
+        return True
+
+    def Break(self, unit):
+        """remove an expired lease. the lease is renamed first so only one
+        owner can break it, and restored if it was renewed meanwhile"""
+        lease = self.UnitFile(unit, 'lease')
+        stale = '%s.%s.stale' % (lease, self.owner)
+        try:
+            os.rename(lease, stale)
+        except OSError:
+            return False
+
+        if not self.IsExpired(stale):
+            if not os.path.exists(lease):
+                os.rename(stale, lease)
+            else:
+                os.remove(stale)
+            return False
+
+        os.remove(stale)
+        logging.warning('broke expired lease %s' % os.path.basename(lease))
+        return True
+
+    def Renew(self, unit):
+        """extend the lease. returns False if the lease was lost"""
+        if self.Owner(unit) != self.owner:
+            return False
+        try:
+            os.utime(self.UnitFile(unit, 'lease'), None)
+        except OSError:
+            return False    # broken by another owner since the check
+        return True
+
+    def Complete(self, unit):
+        """mark the unit done and release the lease. returns False if it
+        was already completed by another owner"""
+        try:
+            fd = os.open(self.UnitFile(unit, 'done'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            return False
+        os.write(fd, self.owner)
+        os.close(fd)
+        self.Release(unit)
+        return True
+
+    def Release(self, unit):
+        """give up the lease without completing the unit"""
+        if self.Owner(unit) == self.owner:
+            try:
+                os.remove(self.UnitFile(unit, 'lease'))
+            except OSError:
+                pass    # broken by another owner since the check
+
+    def Pending(self, units):
+        """units not yet completed"""
+        done = set([f for f in os.listdir(self.leasedir) if f.endswith('.done')])
+        return [u for u in units if os.path.basename(self.UnitFile(u, 'done')) not in done]
+
+    def ClaimNext(self, units):
+        """claim the first pending unit that is not leased, or None"""
+        for unit in self.Pending(units):
+            if self.Claim(unit):
+                return unit
+        return None
+
+
+class TestLeases(unittest.TestCase):
+    """Leases test fixture"""
+    def setUp(self):
+        self.leasedir = tempfile.mkdtemp()
+        self.a = Leases(self.leasedir, owner='a', ttl=60)
+        self.b = Leases(self.leasedir, owner='b', ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.leasedir)
+
+    def test_exclusive(self):
+        """a leased unit is skipped by other owners"""
+        units = [(0, 0), (0, 1)]
+        self.assertEqual(self.a.ClaimNext(units), (0, 0))
+        self.assertEqual(self.b.ClaimNext(units), (0, 1))
+        self.assertEqual(self.a.ClaimNext(units), None)
+        self.assertTrue(self.a.Renew((0, 0)))
+        self.assertFalse(self.b.Renew((0, 0)))
+
+    def test_complete(self):
+        """completed units are no longer pending"""
+        units = [(0, 0), (0, 1)]
+        self.a.Claim((0, 0))
+        self.assertTrue(self.a.Complete((0, 0)))
+        self.assertFalse(self.b.Complete((0, 0)))
+        self.assertEqual(self.b.Pending(units), [(0, 1)])
+        self.assertFalse(self.b.Claim((0, 0)))
+        self.assertEqual(self.b.Owner((0, 0)), None)
+
+    def test_expired(self):
+        """an abandoned lease is reassigned"""
+        self.a.Claim((3, 1))
+        self.assertFalse(self.b.Claim((3, 1)))
+
+        old = time.time() - 120
+        os.utime(self.a.UnitFile((3, 1), 'lease'), (old, old))
+        self.assertTrue(self.b.Claim((3, 1)))
+        self.assertEqual(self.b.Owner((3, 1)), 'b')
+        self.assertFalse(self.a.Renew((3, 1)))
+        self.assertEqual(sorted(os.listdir(self.leasedir)), ['3_1.lease'])
+
+    def test_broken_between(self):
+        """a lease broken after the owner check is lost, not an error"""
+        self.a.Claim((2, 0))
+        self.a.Owner = lambda unit: 'a'
+        os.rename(self.a.UnitFile((2, 0), 'lease'), self.a.UnitFile((2, 0), 'lease') + '.b.stale')
+        self.assertFalse(self.a.Renew((2, 0)))
+        self.a.Release((2, 0))
+        self.assertTrue(self.a.Complete((2, 0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
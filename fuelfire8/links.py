@@ -0,0 +1,101 @@
+"""links: hardlinked model files shared between experiments
+
+CopyModel(link=True) hardlinks files that the copy never modifies (the
+executable and record.nc). python 2 has no os.link on Windows, so links
+are made with pywin32 (win32file.CreateHardLink) there, falling back to a
+copy where links are not supported. code that writes to a possibly
+linked file calls BreakLink first so the other experiments are not
+modified.
+
+example::
+
+    >>> LinkFile(os.path.join(src, 'record.nc'), os.path.join(dst, 'record.nc'))
+    >>> BreakLink(os.path.join(dst, 'record.nc'))   # before opening 'a'
+
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+import unittest2 as unittest
+
+def LinkFile(src, dst):
+    """hardlink <src> to <dst> or copy if hardlinks are not available"""
+    if hasattr(os, 'link'):
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    else:
+        try:
+            import pywintypes
+            import win32file
+            try:
+                win32file.CreateHardLink(dst, src)
+                return
+            except pywintypes.error:
+                pass
+        except ImportError:
+            pass
+    shutil.copy(src, dst)
+
+def LinkCount(path):
+    """number of hardlinks to <path> (1 where links are not available)"""
+    if hasattr(os, 'link'):
+        return os.stat(path).st_nlink
+
+    try:
+        import win32file
+    except ImportError:
+        return 1    # LinkFile copied
+    share = win32file.FILE_SHARE_READ | win32file.FILE_SHARE_WRITE | win32file.FILE_SHARE_DELETE
+    handle = win32file.CreateFile(path, 0, share, None, win32file.OPEN_EXISTING, 0, None)
+    try:
+        return win32file.GetFileInformationByHandle(handle)[7]
+    finally:
+        handle.Close()
+
+def BreakLink(path):
+    """replace a hardlinked file with a private copy so writes do not
+    reach the other links. returns True if a link was broken"""
+    if not os.path.exists(path) or LinkCount(path) < 2:
+        return False
+
+    shutil.copy2(path, path + '.tmp')
+    os.remove(path)    # rename does not replace files on Windows
+    os.rename(path + '.tmp', path)
+    logging.info('copied hardlinked %s before writing' % path)
+    return True
+
+
+class TestLinks(unittest.TestCase):
+    """links test fixture"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.src = os.path.join(self.path, 'src.nc')
+        self.dst = os.path.join(self.path, 'dst.nc')
+        with open(self.src, 'w') as f:
+            f.write('record')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_break(self):
+        """writes to a broken link do not reach the source"""
+        LinkFile(self.src, self.dst)
+        self.assertEqual(LinkCount(self.dst), 2)
+        self.assertTrue(BreakLink(self.dst))
+        self.assertEqual(LinkCount(self.src), 1)
+        self.assertFalse(BreakLink(self.dst))
+
+        with open(self.dst, 'a') as f:
+            f.write(' changed')
+        with open(self.src) as f:
+            self.assertEqual(f.read(), 'record')
+
+
+if __name__ == "__main__":
+    unittest.main()
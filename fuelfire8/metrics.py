@@ -0,0 +1,186 @@
+"""metrics: throughput counters and histograms for running campaigns
+
+the controller records to METRICS. call ExportMetrics to publish them in
+the Prometheus text format as a periodically rewritten file (for the
+node exporter textfile collector) and/or a local http endpoint.
+
+example::
+
+    >>> ExportMetrics(textfile='fuelfire.prom', port=9108)
+    >>> RepeatedFuelFire(path).RunReps(64)
+
+"""
+
+import BaseHTTPServer
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import unittest2 as unittest
+
+# metric name: (type, help, histogram bucket upper bounds)
+METRICDOCS = {
+    'fuelfire_steps_total':
+        ('counter', 'recorded steps completed', None),
+    'fuelfire_replicates_total':
+        ('counter', 'replicate trials completed', None),
+    'fuelfire_retries_total':
+        ('counter', 'steps or replicates retried after a failed model run', None),
+    'fuelfire_wait_timeouts_total':
+        ('counter', 'model runs that did not write the burn file in time', None),
+    'fuelfire_kill_timeouts_total':
+        ('counter', 'model runs that could not be stopped in time', None),
+    'fuelfire_last_progress_seconds':
+        ('gauge', 'unix time of the last completed step or replicate', None),
+    'fuelfire_step_seconds':
+        ('histogram', 'model run duration from start to kill',
+         [5, 10, 20, 30, 60, 90, 120, 180, 300]),
+    'fuelfire_write_seconds':
+        ('histogram', 'NetCDF write and sync duration',
+         [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]),
+    }
+
+
+class Metrics:
+    """thread safe counters, gauges, and histograms labelled by model
+    directory"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}        # (name, model): value
+        self.histograms = {}    # (name, model): [bucket counts, sum, count]
+
+    def Count(self, name, model, inc=1):
+        """add <inc> to a counter"""
+        with self.lock:
+            self.values[(name, model)] = self.values.get((name, model), 0) + inc
+
+    def Set(self, name, model, value):
+        """set a gauge"""
+        with self.lock:
+            self.values[(name, model)] = value
+
+    def Observe(self, name, model, value):
+        """add an observation to a histogram"""
+        buckets = METRICDOCS[name][2]
+        with self.lock:
+            hist = self.histograms.setdefault((name, model), [[0] * len(buckets), 0.0, 0])
+            for (b, bound) in enumerate(buckets):
+                if value <= bound:
+                    hist[0][b] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def Render(self):
+        """metrics in the Prometheus text exposition format"""
+        with self.lock:
+            values = dict(self.values)
+            histograms = dict([(k, (list(v[0]), v[1], v[2])) for (k, v) in self.histograms.items()])
+
+        lines = []
+        for name in sorted(METRICDOCS):
+            (kind, doc, buckets) = METRICDOCS[name]
+            lines.append('# HELP {0} {1}'.format(name, doc))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for ((n, model), value) in sorted(values.items()):
+                if n == name:
+                    lines.append('{0}{{model="{1}"}} {2}'.format(name, model, repr(value)))
+            for ((n, model), (counts, total, count)) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                for (bound, c) in zip(buckets, counts):
+                    lines.append('{0}_bucket{{model="{1}",le="{2}"}} {3}'.format(name, model, bound, c))
+                lines.append('{0}_bucket{{model="{1}",le="+Inf"}} {2}'.format(name, model, count))
+                lines.append('{0}_sum{{model="{1}"}} {2}'.format(name, model, repr(total)))
+                lines.append('{0}_count{{model="{1}"}} {2}'.format(name, model, count))
+        return '\n'.join(lines) + '\n'
+
+    def WriteTextfile(self, filename):
+        """write the rendered metrics by replacing <filename> with a completed temp file"""
+        with open(filename + '.tmp', 'w') as f:
+            f.write(self.Render())
+
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(filename + '.tmp', filename)
+
+
+METRICS = Metrics()
+
+def ExportMetrics(textfile=None, port=None, interval=15, metrics=METRICS):
+    """publish <metrics> by rewriting <textfile> every <interval> seconds
+    and/or serving them at http://localhost:<port>/metrics. both run in
+    daemon threads that stop with the campaign"""
+    if textfile is not None:
+        textfile = os.path.abspath(textfile)
+        def write():
+            while True:
+                metrics.WriteTextfile(textfile)
+                time.sleep(interval)
+        StartDaemon(write)
+
+    if port is not None:
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.Render()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer(('localhost', port), Handler)
+        StartDaemon(server.serve_forever)
+        return server
+
+def StartDaemon(target):
+    """run <target> in a daemon thread"""
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class TestMetrics(unittest.TestCase):
+    """Metrics test fixture"""
+    def test_render(self):
+        """counters, gauges, and histogram buckets are rendered per model"""
+        m = Metrics()
+        m.Count('fuelfire_replicates_total', 'a')
+        m.Count('fuelfire_replicates_total', 'a')
+        m.Count('fuelfire_replicates_total', 'b')
+        m.Set('fuelfire_last_progress_seconds', 'a', 12.5)
+        m.Observe('fuelfire_step_seconds', 'a', 7)
+        m.Observe('fuelfire_step_seconds', 'a', 400)
+        text = m.Render()
+
+        self.assertTrue('fuelfire_replicates_total{model="a"} 2\n' in text)
+        self.assertTrue('fuelfire_replicates_total{model="b"} 1\n' in text)
+        self.assertTrue('fuelfire_last_progress_seconds{model="a"} 12.5\n' in text)
+        self.assertTrue('fuelfire_step_seconds_bucket{model="a",le="5"} 0\n' in text)
+        self.assertTrue('fuelfire_step_seconds_bucket{model="a",le="10"} 1\n' in text)
+        self.assertTrue('fuelfire_step_seconds_bucket{model="a",le="+Inf"} 2\n' in text)
+        self.assertTrue('fuelfire_step_seconds_sum{model="a"} 407.0\n' in text)
+        self.assertTrue('# TYPE fuelfire_write_seconds histogram\n' in text)
+
+    def test_textfile(self):
+        """textfile is replaced with the current metrics"""
+        path = tempfile.mkdtemp()
+        m = Metrics()
+        m.Count('fuelfire_steps_total', 'a')
+        filename = os.path.join(path, 'fuelfire.prom')
+        m.WriteTextfile(filename)
+        m.Count('fuelfire_steps_total', 'a')
+        m.WriteTextfile(filename)
+        with open(filename) as f:
+            self.assertTrue('fuelfire_steps_total{model="a"} 2\n' in f.read())
+        self.assertEqual(os.listdir(path), ['fuelfire.prom'])
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
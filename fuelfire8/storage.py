@@ -0,0 +1,1068 @@
+"""storage: alternate stores for RecordedFuelFire and RepeatedFuelFire data
+
+example::
+
+    >>> manifest = ExportArrays(path)
+    >>> age = num.load(os.path.join(path, 'arrays', 'record_age.npy'), mmap_mode='r')
+
+"""
+
+import collections
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as num
+from numpy.lib.format import open_memmap
+from netCDF4 import Dataset
+import unittest2 as unittest
+
+from fuelfire8.cache import CacheKey
+from fuelfire8.footprint import GetFootprint, FootprintHalo
+
+NETCDF_FORMAT = 'NETCDF3_CLASSIC'
+
+# stored age, fuel, and trials values are offset by -127
+OFFSET = 127
+
+# largest stored age. ages at the cap do not advance
+MAXSTORED = 127
+
+# mosaic file extensions read by LoadMosaic
+MOSAICEXT = ['.csv', '.asc', '.npy', '.dat', '.txt']
+
+# ESRI ascii grid header keywords (NODATA_value is optional)
+ASCHEADER = ['ncols', 'nrows', 'xllcorner', 'yllcorner', 'xllcenter', 'yllcenter',
+             'cellsize', 'nodata_value']
+
+# replicates filtered at a time by ReachCounts
+REACHCHUNK = 8
+
+RECORDVARS = ['age', 'fuel']
+REPEATVARS = ['age', 'fuel', 'hazard', 'reached', 'burnifreach', 'trials']
+
+def ExportArrays(path, dst=None, force=False):
+    """Export record.nc and repeat.nc arrays to a directory of .npy files
+    that can be opened with numpy.load(mmap_mode='r') or numpy.memmap.
+
+    arrays are allocated at full size on the first export and filled in
+    place. later exports only write record steps completed since the
+    last export and repeat steps whose replicate count or derived
+    variables (age, fuel, and step probabilities) changed. repeat arrays
+    are reallocated when repeat.nc has more steps than they hold (a
+    repeat.nc without record.nc, as written by MergeRepeats).
+
+    the derived variables of every repeat step are read on each export
+    to compare digests, so an export reads all of repeat.nc except the
+    trials even when few steps changed.
+
+
+    dst
+        export directory (default <path>/arrays)
+
+    force
+        rewrite every complete record step and every repeat step
+
+
+    manifest.json
+    -------------
+
+    arrays
+        file, dtype, shape, dims, data offset, and value offset (stored
+        value + offset = model value) of each array
+
+    record
+        exported step numbers
+
+    repeat
+        exported replicate count of each repeat step (-1 not exported),
+        digest of its derived variables, and the original step number of
+        each
+
+    """
+    if dst is None:
+        dst = os.path.join(path, 'arrays')
+    if not os.path.exists(dst):
+        os.makedirs(dst)
+
+    manifest = LoadManifest(dst)
+
+    recfile = os.path.join(path, 'record.nc')
+    if os.path.exists(recfile):
+        rec = Dataset(recfile, 'r')
+        ExportRecord(rec, dst, manifest, force)
+        rec.close()
+
+    repfile = os.path.join(path, 'repeat.nc')
+    if os.path.exists(repfile):
+        rep = Dataset(repfile, 'r')
+        maxsteps = None
+        if os.path.exists(recfile):
+            rec = Dataset(recfile, 'r')
+            maxsteps = len(rec.dimensions['t'])
+            rec.close()
+        ExportRepeat(rep, dst, manifest, maxsteps, force)
+        rep.close()
+
+    SaveManifest(dst, manifest)
+    return manifest
+
+def ExportRecord(rec, dst, manifest, force=False):
+    """write completed record steps not yet in the manifest (all with
+    <force>)"""
+    done = set(manifest['record'].get('steps', []))
+    if force:
+        done = set()
+    complete = num.where(rec.variables['complete'][:] == 1)[0]
+    new = [int(step) for step in complete if int(step) not in done]
+
+    mosaics = RecordMosaics(rec)
+    shape = (len(rec.dimensions['t']), len(rec.dimensions['x']), len(rec.dimensions['y']))
+    arrs = [ArrayFile(dst, manifest, 'record_' + var, shape, 'i1', ('t','x','y')) for var in RECORDVARS]
+    for step in new:
+        for (arr, data) in zip(arrs, mosaics.Get(step)):
+            arr[step] = data
+    [arr.flush() for arr in arrs]
+    del arrs
+
+    manifest['record']['steps'] = sorted(done.union(new))
+
+def ExportRepeat(rep, dst, manifest, maxsteps=None, force=False):
+    """write repeat steps whose replicate count or derived variables
+    differ from the manifest (all with <force>). step probabilities are
+    recalculated without changing the replicate count, so each step's
+    derived variables are compared by digest (reading every step)"""
+    reps = list(rep.variables['reps'][:])
+    steps = list(rep.variables['step'][:])
+    maxsteps = max(maxsteps, len(reps))
+    derived = [var for var in REPEATVARS if var != 'trials' and var in rep.variables]
+    digests = [CacheKey(int(reps[s]), *[num.asarray(rep.variables[var][s]) for var in derived])
+               for s in range(len(reps))]
+
+    exported = manifest['repeat'].get('reps', [])
+    exported = exported + [-1] * (maxsteps - len(exported))
+    exporteddigests = manifest['repeat'].get('digests', [])
+    exporteddigests = exporteddigests + [None] * (maxsteps - len(exporteddigests))
+    new = [s for s in range(len(reps)) 
+           if force or int(reps[s]) != exported[s] or digests[s] != exporteddigests[s]]
+
+    for var in REPEATVARS:
+        if var not in rep.variables:
+            continue
+        ncvar = rep.variables[var]
+        shape = (maxsteps,) + ncvar.shape[1:]
+        arr = ArrayFile(dst, manifest, 'repeat_' + var, shape, ncvar.dtype, ncvar.dimensions)
+        for s in new:
+            arr[s] = rep.variables[var][s]
+        arr.flush()
+        del arr
+
+    for s in new:
+        exported[s] = int(reps[s])
+        exporteddigests[s] = digests[s]
+    manifest['repeat']['reps'] = exported
+    manifest['repeat']['digests'] = exporteddigests
+    manifest['repeat']['step'] = [int(step) for step in steps]
+
+def ArrayFile(dst, manifest, name, shape, dtype, dims):
+    """open (or create) the memory mapped .npy file for an exported
+    variable. a file with fewer than shape[0] steps is reallocated"""
+    filename = name + '.npy'
+    if name in manifest['arrays']:
+        arr = open_memmap(os.path.join(dst, filename), mode='r+')
+        if arr.shape[1:] != tuple(shape[1:]):
+            raise StandardError('{0} shape {1} does not match {2}'.format(filename, arr.shape, tuple(shape)))
+        if arr.shape[0] >= shape[0]:
+            return arr
+        return GrowArray(dst, manifest, name, arr, shape[0])
+
+    arr = open_memmap(os.path.join(dst, filename), mode='w+',
+                      dtype=dtype, shape=tuple(shape))
+
+    offset = 0
+    if arr.dtype == num.dtype('i1'):
+        offset = OFFSET
+    manifest['arrays'][name] = {'file': filename,
+                                'dtype': arr.dtype.str,
+                                'shape': list(arr.shape),
+                                'dims': list(dims),
+                                'dataoffset': int(arr.offset),
+                                'valueoffset': offset}
+    return arr
+
+def GrowArray(dst, manifest, name, arr, steps):
+    """reallocate the exported array <arr> with <steps> steps, copying
+    its steps one at a time"""
+    filename = os.path.join(dst, manifest['arrays'][name]['file'])
+    new = open_memmap(filename + '.tmp', mode='w+', dtype=arr.dtype,
+                      shape=(steps,) + arr.shape[1:])
+    for s in range(arr.shape[0]):
+        new[s] = arr[s]
+    new.flush()
+    dataoffset = int(new.offset)
+    del arr, new    # release the maps before replacing the file
+
+    os.remove(filename)    # rename does not replace files on Windows
+    os.rename(filename + '.tmp', filename)
+    manifest['arrays'][name]['shape'][0] = steps
+    manifest['arrays'][name]['dataoffset'] = dataoffset
+    return open_memmap(filename, mode='r+')
+
+def LoadManifest(dst):
+    """load manifest.json or return an empty manifest"""
+    filename = os.path.join(dst, 'manifest.json')
+    if not os.path.exists(filename):
+        return {'arrays': {}, 'record': {}, 'repeat': {}}
+
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+def SaveManifest(dst, manifest):
+    """write manifest.json by replacing it with a completed temp file"""
+    filename = os.path.join(dst, 'manifest.json')
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(filename + '.tmp', filename)
+
+
+def CreateRecord(ncfile, steps, xlen, ylen, fill=True, keyint=None):
+    """create an empty record.nc of <steps> mosaics with shuffled step
+    order (see RecordedFuelFire). <fill> initializes age and fuel.
+    
+    keyint
+        delta encode age and fuel with a full keyframe every <keyint>
+        steps (see RecordMosaics)
+    """
+    nc = Dataset(ncfile, 'w', format=NETCDF_FORMAT)
+    nc.createDimension('t', steps)
+    nc.createDimension('x', xlen)
+    nc.createDimension('y', ylen)
+    
+    if keyint is None:
+        age = nc.createVariable('age', 'i1', ('t','x','y',))
+        fuel = nc.createVariable('fuel', 'i1', ('t','x','y',))
+        if fill:
+            age[:,:,:] = -128
+            fuel[:,:,:] = -128
+    else:
+        nc.keyint = keyint
+        nc.createDimension('k', int(num.ceil(steps / float(keyint))))
+        nc.createDimension('n', None)
+        nc.createVariable('keyage', 'i1', ('k','x','y',)).description = 'age every keyint steps'
+        nc.createVariable('keyfuel', 'i1', ('k','x','y',)).description = 'fuel every keyint steps'
+        nc.createVariable('dstart', 'i4', ('t',)).description = 'first changed cell of each step'
+        nc.createVariable('dcount', 'i4', ('t',)).description = 'changed cells of each step'
+        nc.createVariable('dindex', 'i4', ('n',)).description = 'flat index of changed cell'
+        nc.createVariable('dage', 'i1', ('n',)).description = 'age of changed cell'
+        nc.createVariable('dfuel', 'i1', ('n',)).description = 'fuel of changed cell'
+    
+    complete = nc.createVariable('complete', 'i1', ('t',))
+    shufsteps = nc.createVariable('shufsteps', 'i2', ('t',))
+    complete[:] = 0
+    steplist = num.arange(steps)
+    num.random.shuffle(steplist)
+    shufsteps[:] = steplist
+    return nc
+
+class RecordMosaics:
+    """age and fuel steps of a record.nc stored either as dense (t,x,y)
+    variables or delta encoded (see CreateRecord keyint). 
+    
+    a delta encoded record stores full keyframes every keyint steps. the
+    steps between store only the cells that did not age by one step
+    (burned) or whose fuel changed. steps must be written in order after
+    their keyframe. reconstruction starts from the last step read when
+    possible (sequential reads apply one delta each) or from a cached
+    keyframe."""
+    def __init__(self, nc, cachesize=8):
+        self.nc = nc
+        self.keyint = getattr(nc, 'keyint', None)
+        self.cachesize = cachesize
+        self.keyframes = collections.OrderedDict()
+        self.last = None
+        if self.keyint is not None:
+            for var in ['keyage', 'keyfuel', 'dstart', 'dcount', 'dindex', 'dage', 'dfuel']:
+                self.nc.variables[var].set_auto_mask(False)
+    
+    def Get(self, step):
+        """stored (age, fuel) arrays of <step>"""
+        if self.keyint is None:
+            return (self.nc.variables['age'][step, :, :], self.nc.variables['fuel'][step, :, :])
+        
+        base = step - step % self.keyint
+        if self.last is not None and base <= self.last[0] <= step:
+            (t, age, fuel) = self.last
+            age, fuel = age.copy(), fuel.copy()
+        else:
+            (age, fuel) = [a.copy() for a in self.KeyFrame(base // self.keyint)]
+            t = base
+        
+        shape = age.shape
+        age, fuel = age.astype('i2').ravel(), fuel.ravel()
+        for t in range(t + 1, step + 1):
+            start = self.nc.variables['dstart'][t]
+            count = max(self.nc.variables['dcount'][t], 0)
+            age = num.minimum(age + 1, MAXSTORED)
+            if count > 0:
+                index = self.nc.variables['dindex'][start:start+count]
+                age[index] = self.nc.variables['dage'][start:start+count]
+                fuel[index] = self.nc.variables['dfuel'][start:start+count]
+        
+        age, fuel = age.astype('i1').reshape(shape), fuel.reshape(shape)
+        self.last = (step, age, fuel)
+        return (age.copy(), fuel.copy())
+    
+    def KeyFrame(self, k):
+        """stored (age, fuel) of keyframe <k> from the cache or file"""
+        if k not in self.keyframes:
+            if len(self.keyframes) >= self.cachesize:
+                self.keyframes.popitem(last=False)
+            self.keyframes[k] = (self.nc.variables['keyage'][k, :, :], 
+                                 self.nc.variables['keyfuel'][k, :, :])
+        return self.keyframes[k]
+    
+    def Put(self, step, age, fuel):
+        """write stored age and fuel arrays of <step>"""
+        age = num.asarray(age, dtype='i1')
+        fuel = num.asarray(fuel, dtype='i1')
+        if self.keyint is None:
+            self.nc.variables['age'][step, :, :] = age
+            self.nc.variables['fuel'][step, :, :] = fuel
+            return
+        
+        n = len(self.nc.dimensions['n'])
+        self.nc.variables['dstart'][step] = n
+        if step % self.keyint == 0:
+            k = step // self.keyint
+            self.nc.variables['keyage'][k, :, :] = age
+            self.nc.variables['keyfuel'][k, :, :] = fuel
+            self.nc.variables['dcount'][step] = 0
+            self.keyframes.pop(k, None)
+        else:
+            (prevage, prevfuel) = self.Get(step - 1)
+            expect = num.minimum(prevage.astype('i2') + 1, MAXSTORED)
+            index = num.flatnonzero((age != expect) | (fuel != prevfuel))
+            if len(index) > 0:
+                self.nc.variables['dindex'][n:n+len(index)] = index
+                self.nc.variables['dage'][n:n+len(index)] = age.ravel()[index]
+                self.nc.variables['dfuel'][n:n+len(index)] = fuel.ravel()[index]
+            self.nc.variables['dcount'][step] = len(index)
+        self.last = (step, age.copy(), fuel.copy())
+    
+    def PutSteps(self, t0, ages, fuels):
+        """write stacked stored age and fuel arrays from step <t0>"""
+        if self.keyint is None:
+            self.nc.variables['age'][t0:t0+len(ages), :, :] = ages
+            self.nc.variables['fuel'][t0:t0+len(fuels), :, :] = fuels
+            return
+        
+        for (t, age, fuel) in zip(range(t0, t0 + len(ages)), ages, fuels):
+            self.Put(t, age, fuel)
+    
+    def GetSteps(self, t0, t1, var='age'):
+        """stacked stored <var> (age or fuel) of steps <t0> to <t1>"""
+        if self.keyint is None:
+            return self.nc.variables[var][t0:t1, :, :]
+        
+        return num.array([self.Get(t)[RECORDVARS.index(var)] for t in range(t0, t1)])
+
+def IngestMosaics(ffdir, agesrc, fuelsrc, transpose=True, chunk=32, overwrite=False, keyint=None):
+    """Create <ffdir>/record.nc from many age and fuel mosaics so that
+    replicate experiments (RepeatedFuelFire) can start from them. every
+    step is marked complete and steps are shuffled as in
+    CreateEmptyRecord. mosaics are read and written <chunk> at a time
+    to a temp file that replaces record.nc once every step is ingested.
+
+
+    agesrc, fuelsrc
+        a directory of mosaic files (sorted by name), a list of mosaic
+        files (.csv, ESRI .asc grid, .npy, or whitespace delimited text),
+        a stacked (t, ...) .npy file, or a stacked (t, ...) array.
+        values are model values (0-254).
+
+    transpose
+        transpose each mosaic to the model grid orientation (as
+        ChangeMosaic does for csv files)
+
+    keyint
+        delta encode the record (see CreateRecord)
+
+    """
+    ncfile = os.path.join(ffdir, 'record.nc')
+    if os.path.exists(ncfile) and not overwrite:
+        raise StandardError('record exists {0}'.format(ncfile))
+
+    (steps, ages) = MosaicSource(agesrc)
+    (fuelsteps, fuels) = MosaicSource(fuelsrc)
+    if steps != fuelsteps:
+        raise StandardError('{0} age and {1} fuel mosaics'.format(steps, fuelsteps))
+
+    first = ages.next()
+    ages = itertools.chain([first], ages)
+    shape = num.shape(first)
+    if transpose:
+        shape = shape[::-1]
+
+    agefile = os.path.join(ffdir, 'AGEPIX.DAT')
+    if os.path.exists(agefile) and num.loadtxt(agefile).shape != shape:
+        raise StandardError('mosaic shape {0} does not match {1}'.format(shape, agefile))
+
+    # build a temp file so a failed ingest leaves no partial record
+    nc = CreateRecord(ncfile + '.tmp', steps, shape[0], shape[1], fill=False, keyint=keyint)
+    try:
+        mosaics = RecordMosaics(nc)
+        for t0 in range(0, steps, chunk):
+            t1 = min(t0 + chunk, steps)
+            blocks = {}
+            for (var, source) in [('age', ages), ('fuel', fuels)]:
+                block = num.array([source.next() for t in range(t0, t1)], dtype='i')
+                if transpose:
+                    block = num.transpose(block, (0, 2, 1))
+                if num.any(block < 0) or num.any(block > 254):
+                    raise StandardError('{0} values outside 0-254 in steps {1}-{2}'.format(var, t0, t1))
+                blocks[var] = block - OFFSET
+            mosaics.PutSteps(t0, blocks['age'], blocks['fuel'])
+            nc.variables['complete'][t0:t1] = 1
+            nc.sync()
+            logging.info('ingested mosaics %d-%d of %d' % (t0, t1, steps))
+    except:
+        nc.close()
+        os.remove(ncfile + '.tmp')
+        raise
+
+    nc.close()
+    if os.path.exists(ncfile):
+        os.remove(ncfile)    # rename does not replace files on Windows
+    os.rename(ncfile + '.tmp', ncfile)
+    return steps
+
+def MosaicSource(src):
+    """(number of mosaics, iterator of 2d mosaics) for a directory, file
+    list, stacked .npy file, or stacked array"""
+    if isinstance(src, basestring) and os.path.isdir(src):
+        src = [os.path.join(src, f) for f in sorted(os.listdir(src))
+               if os.path.splitext(f)[1].lower() in MOSAICEXT]
+    elif isinstance(src, basestring):
+        src = num.load(src, mmap_mode='r')
+
+    if isinstance(src, num.ndarray):
+        return (src.shape[0], iter(src))
+    return (len(src), itertools.imap(LoadMosaic, src))
+
+def LoadMosaic(filename):
+    """read a 2d mosaic from a .csv, ESRI .asc grid, .npy, or whitespace
+    delimited text file"""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.npy':
+        return num.load(filename)
+    if ext == '.csv':
+        return num.loadtxt(filename, delimiter=',')
+    if ext == '.asc':
+        return LoadAscGrid(filename)
+    return num.loadtxt(filename)
+
+def LoadAscGrid(filename):
+    """read an ESRI ascii grid, counting header lines by keyword.
+    raises StandardError if the grid does not match ncols and nrows or
+    has NODATA cells"""
+    header = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            words = line.split()
+            if len(words) != 2 or words[0].lower() not in ASCHEADER:
+                break
+            header[words[0].lower()] = words[1]
+
+    grid = num.loadtxt(filename, skiprows=len(header), ndmin=2)
+    if 'nrows' in header and 'ncols' in header:
+        if grid.shape != (int(header['nrows']), int(header['ncols'])):
+            raise StandardError('{0} grid shape {1} does not match its header'.format(filename, grid.shape))
+    if 'nodata_value' in header and num.any(grid == float(header['nodata_value'])):
+        raise StandardError('{0} has NODATA cells'.format(filename))
+    return grid
+
+def CreateRepeat(repfile, reps, xlen, ylen, stepoffset):
+    """create an empty repeat.nc with storage for <reps> replicates per
+    step. the number of steps grows dynamically (see RepeatedFuelFire)"""
+    rep = Dataset(repfile, 'w', format=NETCDF_FORMAT)
+    rep.stepoffset = stepoffset
+    rep.createDimension('t', None)
+    rep.createDimension('r', num.ceil(reps/8.0))
+    rep.createDimension('x', xlen)
+    rep.createDimension('y', ylen)
+    
+    steps = rep.createVariable('step', 'i2', ('t',))
+    steps.description = 'original step number'
+    
+    repvar = rep.createVariable('reps', 'i2', ('t',))
+    repvar.description = 'repeats per step'
+    
+    trials = rep.createVariable('trials', 'i1', ('t','r','x','y',))
+    trials.description = 'bitpacked repeat trials results'
+    
+    age = rep.createVariable('age', 'i1', ('t','x','y',))
+    age.description = 'time since fire in model steps'
+
+    fuel = rep.createVariable('fuel', 'i1', ('t','x','y',))
+    fuel.description = 'fuel'
+
+    haz = rep.createVariable('hazard', 'i2', ('t','x','y',))
+    haz.description = 'burned'
+    
+    reach = rep.createVariable('reached', 'i2', ('t','x','y',))
+    reach.description = 'reached'
+    
+    burnifreach = rep.createVariable('burnifreach', 'i2', ('t','x','y',))
+    burnifreach.description = 'burned and reached'
+    return rep
+
+def MergeRepeats(shards, dst, maxreps=None, footprintcode='5ne', membytes=2**28):
+    """Merge repeat.nc files of the same experiment run in separate
+    directories (e.g. RunLeasedReps shards) into <dst>/repeat.nc
+
+    rows are matched by index (shuffled step order). replicate bits are
+    concatenated in shard order and repacked into 8 replicate blocks
+    (see ShardBlocks). hazard, reached, and burnifreach are counted from
+    the merged trials, and age, fuel, and hoodmed are taken from the
+    first shard with replicates of the step. steps are processed one at
+    a time and trials one block (or slab of rows) at a time.
+
+
+    shards
+        list of model directories containing repeat.nc
+
+    maxreps
+        replicate storage of the merged file (default the largest
+        merged replicate count)
+
+    footprintcode
+        footprint of reached cells (as RepeatedFuelFire)
+
+    membytes
+        memory budget of the unpacked trials of one slab of rows
+
+    """
+    ncs = [Dataset(os.path.join(path, 'repeat.nc'), 'r') for path in shards]
+    [nc.set_auto_mask(False) for nc in ncs]
+    reps = [num.maximum(nc.variables['reps'][:], 0) for nc in ncs]
+    steps = [nc.variables['step'][:] for nc in ncs]
+    nsteps = max([len(r) for r in reps])
+
+    for nc in ncs[1:]:
+        for dim in ['x', 'y']:
+            if len(nc.dimensions[dim]) != len(ncs[0].dimensions[dim]):
+                raise StandardError('shard {0} dimension does not match'.format(dim))
+        if getattr(nc, 'stepoffset', None) != getattr(ncs[0], 'stepoffset', None):
+            raise StandardError('shard stepoffset does not match')
+
+    rowsteps = -num.ones(nsteps, dtype='i')
+    for (r, st) in zip(reps, steps):
+        for i in range(len(r)):
+            if rowsteps[i] >= 0 and st[i] != rowsteps[i]:
+                raise StandardError('row {0} is step {1} and {2}'.format(i, rowsteps[i], st[i]))
+            rowsteps[i] = st[i]
+    blocks = [ShardBlocks(ncs, i) for i in range(nsteps)]
+    totals = num.array([sum([n for (nc, b, n) in rowblocks]) for rowblocks in blocks], dtype='i')
+
+    if maxreps is None:
+        maxreps = max(num.max(totals), 1)
+    elif maxreps < num.max(totals):
+        raise StandardError('{0} replicates do not fit maxreps {1}'.format(num.max(totals), maxreps))
+
+    footprint = GetFootprint(footprintcode)
+    halo = FootprintHalo(footprint)
+    out = CreateRepeat(os.path.join(dst, 'repeat.nc'), maxreps,
+                       len(ncs[0].dimensions['x']), len(ncs[0].dimensions['y']),
+                       getattr(ncs[0], 'stepoffset', 0))
+    out.set_auto_mask(False)
+    copyvars = ['age', 'fuel']
+    if 'hoodmed' in ncs[0].variables:
+        hoodmed = out.createVariable('hoodmed', 'i1', ('t','x','y',))
+        hoodmed.description = 'median age in neighborhood'
+        copyvars.append('hoodmed')
+
+    for i in range(nsteps):
+        # shards that never ran a step may hold unwritten age and fuel
+        rows = [nc for (nc, r) in zip(ncs, reps) if i < len(r) and r[i] > 0]
+        rows += [nc for (nc, r) in zip(ncs, reps) if i < len(r) and r[i] == 0]
+        out.variables['step'][i] = rowsteps[i]
+        out.variables['reps'][i] = totals[i]
+        MergeTrials(out, i, blocks[i])
+
+        for var in copyvars:
+            out.variables[var][i] = rows[0].variables[var][i]
+        for var in ['hazard', 'reached', 'burnifreach']:
+            out.variables[var][i] = 0
+        if totals[i] > 0:
+            for (x0, x1, inner, trials) in TrialSlabs(out, i, totals[i], halo, ReachCellBytes(totals[i]), membytes):
+                for (var, counts) in zip(['hazard', 'reached', 'burnifreach'], ReachCounts(trials, footprint)):
+                    out.variables[var][i, x0:x1, :] = counts[inner]
+        out.sync()
+
+    out.close()
+    [nc.close() for nc in ncs]
+    return True
+
+def TrialSlabs(rep, s, reps, halo, cellbytes, membytes=None):
+    """generate (x0, x1, inner, trials) unpacked (r, x, y) bits of the
+    first <reps> trials of row <s> for slabs of rows x0:x1 sized to
+    <membytes> at <cellbytes> per cell (None for one slab of the whole
+    grid). each slab is read with <halo> rows on each side so footprint
+    filters match a whole grid calculation. inner selects rows x0:x1 of
+    the slab"""
+    blocks = int(num.ceil(reps / 8.0))
+    xlen = len(rep.dimensions['x'])
+    ylen = len(rep.dimensions['y'])
+    slab = xlen
+    if membytes is not None:
+        slab = max(int(membytes / (cellbytes * ylen)) - 2 * halo, 1)
+
+    for x0 in range(0, xlen, slab):
+        x1 = min(x0 + slab, xlen)
+        xa, xb = max(x0 - halo, 0), min(x1 + halo, xlen)
+        packed = num.array(OFFSET + num.asarray(rep.variables['trials'][s, :blocks, xa:xb, :]), dtype='uint8')
+        yield (x0, x1, slice(x0 - xa, x1 - xa), num.unpackbits(packed, axis=0)[:reps])
+
+def ReachCounts(trials, footprint, chunk=REACHCHUNK):
+    """count burned, reached, and burned if reached for a stack of
+    unpacked (r,x,y) replicate trials. a cell is reached when a burned
+    cell falls within its footprint. <chunk> replicates are filtered at
+    a time so only chunk sized filter results are held with the trials"""
+    import scipy.ndimage
+    footprint = num.reshape(footprint, (1,) + num.shape(footprint))
+    hazard = num.zeros(trials.shape[1:], dtype='i4')
+    reached = num.zeros(trials.shape[1:], dtype='i4')
+    burnifreach = num.zeros(trials.shape[1:], dtype='i4')
+    for r0 in range(0, len(trials), chunk):
+        part = trials[r0:r0+chunk]
+        zz = scipy.ndimage.maximum_filter(part, footprint=footprint)
+        hazard += num.sum(part, axis=0, dtype='i4')
+        reached += num.sum(zz, axis=0, dtype='i4')
+        burnifreach += num.sum(num.bitwise_and(part, zz, out=zz), axis=0, dtype='i4')
+    return (hazard, reached, burnifreach)
+
+def ReachCellBytes(reps):
+    """bytes per cell of TrialSlabs counted with ReachCounts: packed and
+    unpacked trials blocks, two chunks of filter results, and three
+    counters"""
+    return 9 * int(num.ceil(max(reps, 1) / 8.0)) + 2 * REACHCHUNK + 12
+
+def ShardBlocks(ncs, i):
+    """(dataset, block, replicates) of the replicate blocks of row <i> in
+    merge order. RunLeasedReps shards hold each leased block at its own
+    block index (blockreps variable), so a block saved by more than one
+    shard is taken once, from the first. other shards hold their
+    replicates in consecutive blocks"""
+    blocks = []
+    leased = {}
+    for nc in ncs:
+        if i >= len(nc.dimensions['t']):
+            continue
+        if 'blockreps' in nc.variables:
+            for (b, n) in enumerate(nc.variables['blockreps'][i]):
+                if n > 0 and b not in leased:
+                    leased[b] = (nc, b, int(n))
+        else:
+            reps = max(int(nc.variables['reps'][i]), 0)
+            blocks += [(nc, b, min(8, reps - 8*b)) for b in range(int(num.ceil(reps/8.0)))]
+    return blocks + [leased[b] for b in sorted(leased)]
+
+def MergeTrials(out, i, blocks):
+    """write the replicate bits of row <i> from each (dataset, block,
+    replicates) in <blocks> into consecutive replicates of <out>. bits
+    are carried across blocks so merged blocks stay full"""
+    carry = num.zeros((0, len(out.dimensions['x']), len(out.dimensions['y'])), dtype='uint8')
+    block = 0
+    for (nc, b, n) in blocks:
+        pack = num.array(127 + nc.variables['trials'][i, b:b+1, :, :], dtype='uint8')
+        carry = num.concatenate([carry, num.unpackbits(pack, axis=0)[:n]])
+        if carry.shape[0] >= 8:
+            out.variables['trials'][i, block, :, :] = -127 + num.packbits(carry[:8], axis=0)[0]
+            carry = carry[8:]
+            block += 1
+
+    if carry.shape[0] > 0:
+        out.variables['trials'][i, block, :, :] = -127 + num.packbits(carry, axis=0)[0]
+        block += 1
+    if block < len(out.dimensions['r']):
+        out.variables['trials'][i, block:, :, :] = -127
+
+
+class TestExportArrays(unittest.TestCase):
+    """ExportArrays test fixture"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        rec = Dataset(os.path.join(self.path, 'record.nc'), 'w', format=NETCDF_FORMAT)
+        rec.createDimension('t', 4)
+        rec.createDimension('x', 5)
+        rec.createDimension('y', 3)
+        rec.createVariable('age', 'i1', ('t','x','y',))[:] = num.arange(60).reshape((4, 5, 3)) - OFFSET
+        rec.createVariable('fuel', 'i1', ('t','x','y',))[:] = -OFFSET
+        rec.createVariable('complete', 'i1', ('t',))[:] = [1, 1, 0, 0]
+        rec.close()
+
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'), 'w', format=NETCDF_FORMAT)
+        rep.createDimension('t', None)
+        rep.createDimension('r', 2)
+        rep.createDimension('x', 5)
+        rep.createDimension('y', 3)
+        rep.createVariable('step', 'i2', ('t',))[:] = [1]
+        rep.createVariable('reps', 'i2', ('t',))[:] = [3]
+        rep.createVariable('trials', 'i1', ('t','r','x','y',))[:] = 5
+        for var in ['age', 'fuel']:
+            rep.createVariable(var, 'i1', ('t','x','y',))[:] = 7
+        for var in ['hazard', 'reached', 'burnifreach']:
+            rep.createVariable(var, 'i2', ('t','x','y',))[:] = 2
+        rep.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_export(self):
+        """exported arrays match the netcdf data"""
+        manifest = ExportArrays(self.path)
+        dst = os.path.join(self.path, 'arrays')
+        age = num.load(os.path.join(dst, 'record_age.npy'), mmap_mode='r')
+        self.assertEqual(age.shape, (4, 5, 3))
+        self.assertTrue(num.all(age[1] == num.arange(15, 30).reshape((5, 3)) - OFFSET))
+        self.assertEqual(manifest['record']['steps'], [0, 1])
+
+        trials = num.load(os.path.join(dst, 'repeat_trials.npy'), mmap_mode='r')
+        self.assertEqual(trials.shape, (4, 2, 5, 3))
+        self.assertTrue(num.all(trials[0] == 5))
+        self.assertEqual(manifest['repeat']['reps'], [3, -1, -1, -1])
+
+        info = manifest['arrays']['repeat_hazard']
+        raw = num.memmap(os.path.join(dst, info['file']), dtype=info['dtype'], mode='r',
+                         offset=info['dataoffset'], shape=tuple(info['shape']))
+        self.assertTrue(num.all(raw[0] == 2))
+        del age, trials, raw
+
+    def test_incremental(self):
+        """later exports only write new or changed steps"""
+        ExportArrays(self.path)
+        dst = os.path.join(self.path, 'arrays')
+
+        rec = Dataset(os.path.join(self.path, 'record.nc'), 'a')
+        rec.variables['age'][0] = 0
+        rec.variables['complete'][2] = 1
+        rec.close()
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'), 'a')
+        rep.variables['reps'][0] = 4
+        rep.variables['hazard'][0] = 3
+        rep.close()
+
+        manifest = ExportArrays(self.path)
+        age = num.load(os.path.join(dst, 'record_age.npy'))
+        self.assertTrue(num.all(age[0] == num.arange(15).reshape((5, 3)) - OFFSET))
+        self.assertTrue(num.all(age[2] == num.arange(30, 45).reshape((5, 3)) - OFFSET))
+        self.assertEqual(manifest['record']['steps'], [0, 1, 2])
+
+        hazard = num.load(os.path.join(dst, 'repeat_hazard.npy'))
+        self.assertTrue(num.all(hazard[0] == 3))
+        self.assertEqual(manifest['repeat']['reps'][0], 4)
+
+    def test_recalculated(self):
+        """steps recalculated without new replicates are rewritten"""
+        ExportArrays(self.path)
+        dst = os.path.join(self.path, 'arrays')
+
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'), 'a')
+        rep.variables['reached'][0] = 7
+        rep.close()
+        rec = Dataset(os.path.join(self.path, 'record.nc'), 'a')
+        rec.variables['age'][0] = 0
+        rec.close()
+
+        ExportArrays(self.path)
+        reached = num.load(os.path.join(dst, 'repeat_reached.npy'))
+        self.assertTrue(num.all(reached[0] == 7))
+        age = num.load(os.path.join(dst, 'record_age.npy'))
+        self.assertTrue(num.all(age[0] == num.arange(15).reshape((5, 3)) - OFFSET))
+
+        ExportArrays(self.path, force=True)
+        age = num.load(os.path.join(dst, 'record_age.npy'))
+        self.assertTrue(num.all(age[0] == 0))
+
+    def test_grow(self):
+        """repeat arrays grow with repeat.nc steps without a record"""
+        os.remove(os.path.join(self.path, 'record.nc'))
+        ExportArrays(self.path)
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'), 'a')
+        rep.variables['step'][1:3] = [2, 3]
+        rep.variables['reps'][1:3] = [8, 8]
+        rep.variables['trials'][1:3] = 6
+        rep.variables['hazard'][1:3] = 4
+        rep.close()
+
+        manifest = ExportArrays(self.path)
+        dst = os.path.join(self.path, 'arrays')
+        self.assertEqual(manifest['repeat']['reps'], [3, 8, 8])
+        self.assertEqual(manifest['arrays']['repeat_trials']['shape'], [3, 2, 5, 3])
+        hazard = num.load(os.path.join(dst, 'repeat_hazard.npy'))
+        self.assertEqual(list(hazard[:, 0, 0]), [2, 4, 4])
+        trials = num.load(os.path.join(dst, 'repeat_trials.npy'))
+        self.assertEqual(list(trials[:, 0, 0, 0]), [5, 6, 6])
+
+
+class TestMergeRepeats(unittest.TestCase):
+    """MergeRepeats test fixture"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.burns = {}
+        for (shard, reps) in [('a', [3, 8]), ('b', [6, 0]), ('c', [9])]:
+            os.makedirs(os.path.join(self.path, shard))
+            rep = CreateRepeat(os.path.join(self.path, shard, 'repeat.nc'), 16, 4, 5, 1)
+            for (i, r) in enumerate(reps):
+                burn = num.random.randint(0, 2, (r, 4, 5)).astype('uint8')
+                self.burns[(shard, i)] = burn
+                rep.variables['step'][i] = 10 + i
+                rep.variables['reps'][i] = r
+                rep.variables['trials'][i] = -127
+                padded = num.zeros((16, 4, 5), dtype='uint8')
+                padded[:r] = burn
+                rep.variables['trials'][i] = -127 + num.packbits(padded, axis=0)
+                rep.variables['age'][i] = i
+                rep.variables['fuel'][i] = i
+                for var in ['hazard', 'reached', 'burnifreach']:
+                    rep.variables[var][i] = num.sum(burn, axis=0)
+            rep.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_merge(self):
+        """replicate bits are concatenated and counts summed"""
+        shards = [os.path.join(self.path, shard) for shard in ['a', 'b', 'c']]
+        MergeRepeats(shards, self.path)
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        rep.set_auto_mask(False)
+        self.assertEqual(len(rep.dimensions['r']), 3)
+        self.assertEqual(list(rep.variables['reps'][:]), [18, 8])
+        self.assertEqual(list(rep.variables['step'][:]), [10, 11])
+
+        trials = num.unpackbits(num.array(127 + rep.variables['trials'][0], dtype='uint8'), axis=0)
+        expect = num.concatenate([self.burns[('a', 0)], self.burns[('b', 0)], self.burns[('c', 0)]])
+        self.assertTrue(num.all(trials[:18] == expect))
+        self.assertTrue(num.all(trials[18:] == 0))
+        self.assertTrue(num.all(rep.variables['hazard'][0] == num.sum(expect, axis=0)))
+
+        trials = num.unpackbits(num.array(127 + rep.variables['trials'][1], dtype='uint8'), axis=0)
+        self.assertTrue(num.all(trials[:8] == self.burns[('a', 1)]))
+        self.assertTrue(num.all(trials[8:] == 0))
+        rep.close()
+
+    def test_empty_rows(self):
+        """initialized rows without replicates are not merged"""
+        import scipy.ndimage
+        os.makedirs(os.path.join(self.path, 'e'))
+        rep = CreateRepeat(os.path.join(self.path, 'e', 'repeat.nc'), 16, 4, 5, 1)
+        for i in range(2):
+            rep.variables['step'][i] = 10 + i
+            rep.variables['reps'][i] = 0
+        rep.close()
+
+        shards = [os.path.join(self.path, shard) for shard in ['e', 'b', 'a']]
+        MergeRepeats(shards, self.path)
+        rep = Dataset(os.path.join(self.path, 'repeat.nc'))
+        rep.set_auto_mask(False)
+        self.assertEqual(list(rep.variables['reps'][:]), [9, 8])
+        self.assertTrue(num.all(rep.variables['age'][:] == [[[0]], [[1]]]))
+
+        footprint = GetFootprint('5ne')[num.newaxis]
+        for (i, expect) in enumerate([num.concatenate([self.burns[('b', 0)], self.burns[('a', 0)]]), self.burns[('a', 1)]]):
+            reached = scipy.ndimage.maximum_filter(expect, footprint=footprint)
+            self.assertTrue(num.all(rep.variables['hazard'][i] == num.sum(expect, axis=0)))
+            self.assertTrue(num.all(rep.variables['reached'][i] == num.sum(reached, axis=0)))
+            self.assertTrue(num.all(rep.variables['burnifreach'][i] == num.sum(expect & reached, axis=0)))
+        rep.close()
+
+    def test_mismatch(self):
+        """shards of different steps are rejected"""
+        rep = Dataset(os.path.join(self.path, 'b', 'repeat.nc'), 'a')
+        rep.variables['step'][0] = 3
+        rep.close()
+        shards = [os.path.join(self.path, shard) for shard in ['a', 'b']]
+        self.assertRaises(StandardError, MergeRepeats, shards, self.path)
+
+
+class TestReachCounts(unittest.TestCase):
+    """TrialSlabs and ReachCounts test fixture"""
+    def setUp(self):
+        import scipy.ndimage
+        self.path = tempfile.mkdtemp()
+        self.footprint = GetFootprint('5ne')
+        self.trials = (num.random.rand(19, 12, 9) < 0.1).astype('uint8')
+        self.reached = num.array([scipy.ndimage.maximum_filter(t, footprint=self.footprint) for t in self.trials])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_chunks(self):
+        """chunked counts match filtering each replicate"""
+        for chunk in [1, 8, 32]:
+            (hazard, reached, burnifreach) = ReachCounts(self.trials, self.footprint, chunk)
+            self.assertTrue(num.all(hazard == num.sum(self.trials, axis=0)))
+            self.assertTrue(num.all(reached == num.sum(self.reached, axis=0)))
+            self.assertTrue(num.all(burnifreach == num.sum(self.trials & self.reached, axis=0)))
+
+    def test_slabs(self):
+        """counts stitched from slabs match the whole grid"""
+        rep = CreateRepeat(os.path.join(self.path, 'repeat.nc'), 24, 12, 9, 0)
+        padded = num.zeros((24, 12, 9), dtype='uint8')
+        padded[:19] = self.trials
+        rep.variables['trials'][0] = -127 + num.packbits(padded, axis=0)
+        rep.set_auto_mask(False)
+
+        halo = FootprintHalo(self.footprint)
+        for membytes in [None, 1]:
+            reached = num.zeros((12, 9), dtype='i4')
+            for (x0, x1, inner, trials) in TrialSlabs(rep, 0, 19, halo, ReachCellBytes(19), membytes):
+                reached[x0:x1] = ReachCounts(trials, self.footprint)[1][inner]
+            self.assertTrue(num.all(reached == num.sum(self.reached, axis=0)))
+        rep.close()
+
+
+class TestIngestMosaics(unittest.TestCase):
+    """IngestMosaics test fixture"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.src = os.path.join(self.path, 'mosaics')
+        os.makedirs(os.path.join(self.src, 'age'))
+        os.makedirs(os.path.join(self.src, 'fuel'))
+        self.ages = num.random.randint(0, 255, (5, 3, 4))
+        self.fuels = num.random.randint(0, 10, (5, 3, 4))
+        header = 'ncols 4\nnrows 3\nxllcorner 0\nyllcorner 0\ncellsize 1\nNODATA_value -9999\n'
+        for t in range(5):
+            num.savetxt(os.path.join(self.src, 'age', 'age%02d.csv' % t), self.ages[t], fmt='%i', delimiter=',')
+            with open(os.path.join(self.src, 'fuel', 'fuel%02d.asc' % t), 'w') as f:
+                f.write(header)
+                num.savetxt(f, self.fuels[t], fmt='%i')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_files(self):
+        """directories of csv and ascii grid mosaics are ingested transposed"""
+        steps = IngestMosaics(self.path, os.path.join(self.src, 'age'), os.path.join(self.src, 'fuel'), chunk=2)
+        self.assertEqual(steps, 5)
+        rec = Dataset(os.path.join(self.path, 'record.nc'))
+        rec.set_auto_mask(False)
+        self.assertEqual(rec.variables['age'].shape, (5, 4, 3))
+        self.assertTrue(num.all(rec.variables['age'][:].astype('i') + 127 == num.transpose(self.ages, (0, 2, 1))))
+        self.assertTrue(num.all(rec.variables['fuel'][:].astype('i') + 127 == num.transpose(self.fuels, (0, 2, 1))))
+        self.assertTrue(num.all(rec.variables['complete'][:] == 1))
+        self.assertEqual(sorted(rec.variables['shufsteps'][:]), range(5))
+        rec.close()
+
+        self.assertRaises(StandardError, IngestMosaics, self.path, self.ages, self.fuels)
+
+    def test_asc_header(self):
+        """ascii grids are read with or without NODATA_value"""
+        fueldir = os.path.join(self.src, 'short')
+        os.makedirs(fueldir)
+        for t in range(5):
+            with open(os.path.join(fueldir, 'fuel%02d.asc' % t), 'w') as f:
+                f.write('NCOLS 4\nNROWS 3\nXLLCENTER 0\nYLLCENTER 0\nCELLSIZE 1\n')
+                num.savetxt(f, self.fuels[t], fmt='%i')
+        IngestMosaics(self.path, self.ages, fueldir, transpose=False)
+        rec = Dataset(os.path.join(self.path, 'record.nc'))
+        rec.set_auto_mask(False)
+        self.assertTrue(num.all(rec.variables['fuel'][:].astype('i') + 127 == self.fuels))
+        rec.close()
+
+        filename = os.path.join(self.path, 'nodata.asc')
+        fuels = self.fuels[0].copy()
+        fuels[1, 2] = -9999
+        with open(filename, 'w') as f:
+            f.write('ncols 4\nnrows 3\nxllcorner 0\nyllcorner 0\ncellsize 1\nNODATA_value -9999\n')
+            num.savetxt(f, fuels, fmt='%i')
+        self.assertRaises(StandardError, LoadMosaic, filename)
+
+    def test_stacked(self):
+        """stacked arrays and .npy files are ingested"""
+        num.save(os.path.join(self.path, 'fuel.npy'), self.fuels)
+        IngestMosaics(self.path, self.ages, os.path.join(self.path, 'fuel.npy'), transpose=False)
+        rec = Dataset(os.path.join(self.path, 'record.nc'))
+        rec.set_auto_mask(False)
+        self.assertTrue(num.all(rec.variables['age'][:].astype('i') + 127 == self.ages))
+        self.assertTrue(num.all(rec.variables['fuel'][:].astype('i') + 127 == self.fuels))
+        rec.close()
+
+    def test_mismatch(self):
+        """mosaic counts and shapes must match"""
+        self.assertRaises(StandardError, IngestMosaics, self.path, self.ages, self.fuels[:4])
+        num.savetxt(os.path.join(self.path, 'AGEPIX.DAT'), num.zeros((3, 4)))
+        self.assertRaises(StandardError, IngestMosaics, self.path, self.ages, self.fuels)
+
+    def test_invalid(self):
+        """a failed ingest leaves no record so it can be retried"""
+        ages = self.ages.copy()
+        ages[4, 0, 0] = 300
+        self.assertRaises(StandardError, IngestMosaics, self.path, ages, self.fuels, chunk=2)
+        self.assertEqual(os.listdir(self.path), ['mosaics'])
+
+        self.assertEqual(IngestMosaics(self.path, self.ages, self.fuels, chunk=2), 5)
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'record.nc')))
+
+
+class TestRecordMosaics(unittest.TestCase):
+    """RecordMosaics test fixture"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        steps = 11
+        self.ages = num.zeros((steps, 6, 5), dtype='i')
+        self.fuels = num.zeros((steps, 6, 5), dtype='i')
+        self.ages[0] = num.random.randint(0, 255, (6, 5))
+        for t in range(1, steps):
+            self.ages[t] = num.minimum(self.ages[t-1] + 1, 254)
+            burn = num.random.rand(6, 5) < 0.1
+            self.ages[t][burn] = 0
+            self.fuels[t] = num.minimum(self.ages[t] // 50, 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_delta(self):
+        """delta encoded steps are reconstructed in any order"""
+        ncfile = os.path.join(self.path, 'record.nc')
+        nc = CreateRecord(ncfile, 11, 6, 5, keyint=4)
+        mosaics = RecordMosaics(nc)
+        for t in range(11):
+            mosaics.Put(t, self.ages[t] - OFFSET, self.fuels[t] - OFFSET)
+        nc.close()
+
+        nc = Dataset(ncfile)
+        self.assertEqual(len(nc.dimensions['k']), 3)
+        self.assertTrue(len(nc.dimensions['n']) < 8 * 6 * 5)
+        mosaics = RecordMosaics(nc, cachesize=1)
+        for t in [10, 3, 9, 0, 7, 8, 5, 6]:
+            (age, fuel) = mosaics.Get(t)
+            self.assertTrue(num.all(age.astype('i') + OFFSET == self.ages[t]), t)
+            self.assertTrue(num.all(fuel.astype('i') + OFFSET == self.fuels[t]), t)
+        ages = mosaics.GetSteps(2, 6, 'age')
+        self.assertTrue(num.all(ages.astype('i') + OFFSET == self.ages[2:6]))
+        nc.close()
+
+    def test_ingest(self):
+        """ingested records match with and without delta encoding"""
+        os.makedirs(os.path.join(self.path, 'delta'))
+        IngestMosaics(self.path, self.ages, self.fuels, transpose=False)
+        IngestMosaics(os.path.join(self.path, 'delta'), self.ages, self.fuels, transpose=False, keyint=5, chunk=3)
+        dense = Dataset(os.path.join(self.path, 'record.nc'))
+        delta = Dataset(os.path.join(self.path, 'delta', 'record.nc'))
+        for t in range(11):
+            for (a, b) in zip(RecordMosaics(dense).Get(t), RecordMosaics(delta).Get(t)):
+                self.assertTrue(num.all(num.asarray(a) == b))
+        dense.close()
+        delta.close()
+
+
+if __name__ == "__main__":
+    unittest.main()